@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from .core import DUPLICATE_KEY, RESTAURANTS, TourIndex
+from .io import MAX_ROWS, MAX_COLS, scan_schedule_directory
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# directory in the user's cache directory holding the caches of every input directory
+CACHE_APP_DIRECTORY = "invoice-generator"
+# bump whenever read_file/read_sheet change the shape of what they return
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+INDEX_FILE = "index.json"
+DIRECTORY_INDEX_FILE = "directories.json"
+# bump whenever parse_schedule_day changes which files are schedules or which day they are for
+DIRECTORY_INDEX_VERSION = 2
+TOUR_INDEX_FILE = "tours.json"
+# bump whenever the normalization of the DUPLICATE_KEY columns changes, which changes the hashed keys
+TOUR_INDEX_VERSION = 2
+# a directory changed this close to its scan can change again without its mtime moving on filesystems
+# with coarse timestamps (2 seconds on FAT), so its listing is stored but rescanned on the next run
+RACY_MTIME_NS = 2 * 10 ** 9
+# held while an index is merged and saved, a watcher and the runs share the cache directory
+LOCK_FILE = "lock"
+
+
+def user_cache_root():
+    if sys.platform == "win32":
+        return os.environ.get("LOCALAPPDATA") or os.path.expanduser(os.path.join("~", "AppData", "Local"))
+    if sys.platform == "darwin":
+        return os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    return os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache"))
+
+
+def cache_directory(input_directory):
+    """
+    Where the caches of an input directory are kept. The schedule cache is unpickled, so it lives in
+    the user's own cache directory rather than in the input directory, which is usually a folder
+    shared with everyone who edits the schedules.
+    """
+    app_directory = os.path.join(user_cache_root(), CACHE_APP_DIRECTORY)
+    os.makedirs(app_directory, mode=0o700, exist_ok=True)
+    key = hashlib.sha256(os.path.abspath(input_directory).encode()).hexdigest()[:16]
+    return os.path.join(app_directory, key)
+
+
+@contextmanager
+def locked(directory):
+    """ Holds the lock of a cache directory, which only one process at a time can take """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a+b") as f:
+        if sys.platform == "win32":
+            # locks the first byte, LK_LOCK tries again every second for 10 seconds
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if sys.platform == "win32":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def write_atomic(path, data: bytes):
+    """ Replaces path by data through a temporary file of its own, a reader sees either file whole """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json(path, value):
+    write_atomic(path, json.dumps(value).encode())
+
+
+def read_json(path) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def reader_rules():
+    rules = [CACHE_VERSION, MAX_ROWS, MAX_COLS, [(r.name, r.sheet_prefix) for r in RESTAURANTS]]
+    return hashlib.sha256(json.dumps(rules).encode()).hexdigest()
+
+
+def hash_file(file):
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ScheduleCache:
+    """
+    On-disk cache of read_file results, keyed by path and validated against the file's
+    mtime and size (or its content hash when use_hash is set).
+
+    Entries are pickled rather than written as parquet because the schedule columns
+    hold mixed python values (dates, strings, numbers) that must round-trip unchanged.
+    Loading a pickle can run code, directory must only be writable by the user, see
+    cache_directory.
+
+    Other processes, like a watcher, can use the same directory. Each version of a file gets its own
+    pickle and save merges the index with the one on disk, so neither loses the other's entries.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, use_hash=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.use_hash = use_hash
+        self.rules = reader_rules()
+        self.entries = {}
+        self.pending = {}
+        # paths put and pickles removed since the index was loaded or saved
+        self.changed = set()
+        self.removed = {}
+        self.load()
+
+    def load(self):
+        index = read_json(os.path.join(self.directory, INDEX_FILE))
+        if index is None:
+            return
+
+        self.entries = index.get("entries", {})
+        if index.get("rules") != self.rules:
+            for path in list(self.entries):
+                self.remove(path)
+
+    def key(self, file):
+        stat = os.stat(file)
+        return {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": hash_file(file) if self.use_hash else None,
+        }
+
+    def matches(self, entry, key):
+        if entry["size"] != key["size"]:
+            return False
+        if key["hash"] is not None and entry["hash"] is not None:
+            return entry["hash"] == key["hash"]
+        return entry["mtime"] == key["mtime"]
+
+    def fresh(self, file):
+        path = os.path.abspath(file)
+        # remember the key computed before the file is read so that an edit made while
+        # reading invalidates the entry on the next run instead of being masked by it
+        key = self.pending[path] = self.key(file)
+
+        entry = self.entries.get(path)
+        return entry is not None and self.matches(entry, key)
+
+    def read(self, file):
+        path = os.path.abspath(file)
+        entry = self.entries[path]
+        try:
+            with open(os.path.join(self.directory, entry["name"]), "rb") as f:
+                result = pickle.load(f)
+        except Exception:
+            # unreadable or written by an incompatible pandas version, read the file again
+            self.remove(path)
+            return None
+
+        entry["last_used"] = time.time()
+        return result
+
+    def get(self, file):
+        return self.read(file) if self.fresh(file) else None
+
+    def put(self, file, result):
+        path = os.path.abspath(file)
+        key = self.pending.pop(path, None) or self.key(file)
+        # named after the version of the file, a process putting another version does not overwrite it
+        name = hashlib.sha1(json.dumps([path, key]).encode()).hexdigest() + ".pkl"
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(os.path.join(self.directory, name), data)
+
+        previous = self.entries.get(path)
+        if previous is not None and previous["name"] != name:
+            self.remove_file(previous["name"])
+        self.entries[path] = {**key, "name": name, "bytes": len(data), "last_used": time.time()}
+        self.changed.add(path)
+
+    def remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return
+        self.changed.discard(path)
+        self.removed[path] = entry["name"]
+        self.remove_file(entry["name"])
+
+    def merge(self, entries):
+        """ Takes in the entries other processes saved since the index was loaded """
+        for path, entry in entries.items():
+            ours = self.entries.get(path)
+            if ours is not None and ours["name"] == entry["name"]:
+                ours["last_used"] = max(ours["last_used"], entry["last_used"])
+            elif self.removed.get(path) == entry["name"]:
+                continue
+            elif ours is not None and path in self.changed and ours["mtime"] >= entry["mtime"]:
+                # both read the file, the version read here is at least as recent
+                self.remove_file(entry["name"])
+            else:
+                if ours is not None and path in self.changed:
+                    self.remove_file(ours["name"])
+                self.entries[path] = entry
+
+        # the others removed these, keep only those put again here
+        for path in list(self.entries):
+            if path not in entries and path not in self.changed:
+                del self.entries[path]
+
+    def evict(self):
+        total = sum(entry["bytes"] for entry in self.entries.values())
+        for path, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= entry["bytes"]
+            self.remove(path)
+
+    def save(self):
+        self.pending.clear()
+
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with locked(self.directory):
+            index = read_json(index_path)
+            if index is not None and index.get("rules") == self.rules:
+                self.merge(index.get("entries", {}))
+            self.evict()
+            write_json(index_path, {"rules": self.rules, "entries": self.entries})
+        self.changed.clear()
+        self.removed.clear()
+
+
+class DirectoryIndex:
+    """
+    Persistent map from each month folder to the day of every schedule in it. A folder is only
+    listed again when its mtime changes, which happens whenever a file is added, removed or renamed,
+    or when it was modified around the time it was listed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        # folders listed since the index was loaded or saved
+        self.changed = set()
+        self.load()
+
+    def load(self):
+        index = read_json(os.path.join(self.directory, DIRECTORY_INDEX_FILE))
+        if index is not None and index.get("version") == DIRECTORY_INDEX_VERSION:
+            self.entries = index.get("entries", {})
+
+    def days(self, dir_path) -> dict[str, int] | None:
+        path = os.path.abspath(dir_path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        entry = self.entries.get(path)
+        # a change made in the same mtime tick as the scan, even one just after it, keeps the mtime
+        if entry is not None and entry["mtime"] == mtime and mtime < entry["scanned"] - RACY_MTIME_NS:
+            return entry["files"]
+
+        scanned = time.time_ns()
+        files = scan_schedule_directory(path)
+        self.entries[path] = {"mtime": mtime, "scanned": scanned, "files": files}
+        self.changed.add(path)
+        return files
+
+    def save(self):
+        if not self.changed:
+            return
+
+        index_path = os.path.join(self.directory, DIRECTORY_INDEX_FILE)
+        with locked(self.directory):
+            # the folders other processes listed are kept, those listed here are more recent
+            index = read_json(index_path)
+            if index is not None and index.get("version") == DIRECTORY_INDEX_VERSION:
+                self.entries = {**index.get("entries", {}),
+                                **{path: self.entries[path] for path in self.changed}}
+            write_json(index_path, {"version": DIRECTORY_INDEX_VERSION, "entries": self.entries})
+        self.changed.clear()
+
+
+def read_tour_files(directory) -> dict[str, list[int]]:
+    index = read_json(os.path.join(directory, TOUR_INDEX_FILE))
+    if index is None or index.get("version") != TOUR_INDEX_VERSION or index.get("key") != DUPLICATE_KEY:
+        return {}
+    return index.get("files", {})
+
+
+def load_tour_index(directory) -> TourIndex:
+    # the tours of a renamed or deleted schedule are no longer billed from it
+    return TourIndex({path: keys for path, keys in read_tour_files(directory).items() if os.path.isfile(path)})
+
+
+def save_tour_index(directory, tours: TourIndex):
+    with locked(directory):
+        # another run may have saved the claims of files this run did not read in the meantime
+        released = set(tours.paths.values())
+        claimed = {key for path, keys in tours.files.items() if path in released for key in keys}
+        files = {path: [key for key in keys if key not in claimed]
+                 for path, keys in read_tour_files(directory).items() if path not in released}
+        files.update({path: keys for path, keys in tours.files.items() if path in released or path not in files})
+        write_json(os.path.join(directory, TOUR_INDEX_FILE),
+                   {"version": TOUR_INDEX_VERSION, "key": DUPLICATE_KEY, "files": files})
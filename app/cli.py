@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+import traceback
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from .core import RESTAURANTS
+from .io import READERS
+from .pipeline import generate_invoices
+from .watch import WATCH_INTERVAL, ScheduleWatcher
+
+
+def parse_args(argv=None):
+    to_date = date.today()
+    from_date = to_date + relativedelta(months=-1, day=1)
+    restaurant_names = [restaurant.name for restaurant in RESTAURANTS]
+
+    parser = argparse.ArgumentParser(prog="python -m app", description="Generate invoices without the GUI.")
+    parser.add_argument("input_directory", help="directory containing the month folders and Rates.xlsx")
+    parser.add_argument("-o", "--output-directory", help="where to write the invoices, defaults to the input directory")
+    parser.add_argument("--from-date", type=date.fromisoformat, default=from_date,
+                        help="first service date to invoice, YYYY-MM-DD (default: %(default)s)")
+    parser.add_argument("--to-date", type=date.fromisoformat, default=to_date,
+                        help="last service date to invoice, YYYY-MM-DD (default: %(default)s)")
+    parser.add_argument("-r", "--restaurant", action="append", choices=restaurant_names, dest="restaurants",
+                        help="only generate invoices for this restaurant, can be repeated (default: all)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of processes used to read schedules (default: %(default)s)")
+    parser.add_argument("--reader", choices=READERS, default="openpyxl",
+                        help="backend used to read schedules, fast falls back to openpyxl when needed "
+                             "(default: %(default)s)")
+    parser.add_argument("--chunk-files", type=int, metavar="N",
+                        help="read and process schedules N files at a time to bound memory use "
+                             "(default: read everything at once)")
+    parser.add_argument("--parquet", action="store_true",
+                        help="also write the serviced, cancelled and invalid rows to a Parquet dataset "
+                             "partitioned by restaurant and month")
+    parser.add_argument("--split-invalid", action="store_true",
+                        help="write the invalid tours of each reason to their own sheet of Invalid.xlsx")
+    parser.add_argument("--no-fuzzy", action="store_false", dest="fuzzy",
+                        help="do not suggest the most similar DMC or service type of the rates file for "
+                             "unknown ones, the aliases accepted in Aliases.json are still applied")
+    parser.add_argument("--no-cache", action="store_false", dest="use_cache",
+                        help="read every schedule again instead of using the parsed schedule cache")
+    parser.add_argument("--no-incremental", action="store_false", dest="incremental",
+                        help="regenerate every invoice instead of copying unchanged ones from the previous run")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write the timing and memory of every stage, file and invoice to FILE, "
+                             "as csv when it ends with .csv and as json otherwise")
+    parser.add_argument("--watch", action="store_true",
+                        help="instead of generating invoices, keep reading new and changed schedules of the "
+                             "previous, current and next month into the cache until interrupted")
+    parser.add_argument("--poll-interval", type=float, default=WATCH_INTERVAL, metavar="SECONDS",
+                        help="seconds between two scans of the month folders with --watch (default: %(default)s)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print progress messages")
+    args = parser.parse_args(argv)
+    if args.watch and not args.use_cache:
+        parser.error("--watch reads schedules into the cache and cannot be combined with --no-cache")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    restaurants = [restaurant for restaurant in RESTAURANTS
+                   if args.restaurants is None or restaurant.name in args.restaurants]
+
+    # progress goes to stderr so that stdout only carries the summary
+    updater = (lambda x: None) if args.quiet else (lambda x: print(x, file=sys.stderr, flush=True))
+
+    if args.watch:
+        updater(f"Watching {args.input_directory} for schedules, press Ctrl+C to stop")
+        try:
+            ScheduleWatcher(updater, args.input_directory, args.reader).run(args.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    result = {
+        "input_directory": args.input_directory,
+        "output_directory": args.output_directory or args.input_directory,
+        "from_date": args.from_date.isoformat(),
+        "to_date": args.to_date.isoformat(),
+    }
+    try:
+        summary = generate_invoices(updater, args.input_directory, args.from_date, args.to_date,
+                                    workers=args.workers, use_cache=args.use_cache, incremental=args.incremental,
+                                    output_directory=args.output_directory, restaurants=restaurants,
+                                    reader=args.reader, chunk_files=args.chunk_files,
+                                    parquet=args.parquet, fuzzy=args.fuzzy,
+                                    split_invalid=args.split_invalid)
+        result["status"] = "ok"
+        result.update(summary.to_dict())
+        updater(summary.profiler.format_summary())
+        if args.profile:
+            summary.profiler.dump(args.profile)
+        exit_code = 0
+    except Exception:
+        updater(traceback.format_exc())
+        result["status"] = "error"
+        result["error"] = traceback.format_exc(limit=0).strip()
+        exit_code = 1
+
+    print(json.dumps(result, indent=2))
+    sys.exit(exit_code)
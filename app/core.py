@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 from datetime import datetime, date
 from textwrap import dedent
@@ -5,17 +6,40 @@ from textwrap import dedent
 import numpy as np
 import pandas
 from dateutil import parser
-from pandas import DataFrame, Timestamp, concat
+from pandas import DataFrame, Series, Timestamp, concat
+
+from .matching import NameResolver
+from .profiling import span
 
 pandas.set_option("display.max_rows", None)
 pandas.set_option("display.max_columns", None)
 pandas.set_option("display.width", None)
+# the filters assign columns on slices of the schedule frame and rely on copy on write for that
+pandas.set_option("mode.copy_on_write", True)
+
+# formats parsed in bulk before falling back to dateutil, only formats which dateutil resolves
+# identically (month first, four digit years, no locale dependent month names) belong here
+DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%m-%d-%Y", "%m/%d/%Y"]
+# schedule columns which repeat a handful of values on every row, kept as categoricals after reading
+CATEGORICAL_COLUMNS = ["File Name", "Restaurant", "Dmc", "Service Type", "Tour Manager", "Remarks", "Delivery"]
+COUNT_COLUMNS = ["Adult", "Children"]
+# a tour found under the same key in two schedule files is billed from the first file only
+DUPLICATE_KEY = ["Tour Code", "Service Date Cleaned", "Dmc To Join", "Service Type", "Restaurant"]
+# what astype("str") makes of a missing tour code, rows without a tour code are never duplicates
+MISSING_TOUR_CODES = ["", "None", "nan", "<NA>"]
+# first day a rates table applies to, NaT for the table which applies from the start
+EFFECTIVE_FROM = "Effective From"
+# the aliases applied to a row and, for a row left with an unknown name, the most similar known one
+ALIAS = "Alias"
+SUGGESTION = "Suggestion"
 
 
 @dataclass
 class Restaurant:
     name: str
     address: str
+    # lowercase prefix used to find the sheet when its name does not match exactly
+    sheet_prefix: str
 
 
 RESTAURANTS = [
@@ -23,22 +47,22 @@ RESTAURANTS = [
         Dawat
         58 Avenue du 8 mai 1945
         93150 Le Blanc Mesnil Paris, France.
-    """).strip()),
+    """).strip(), "d"),
     Restaurant("WelcomeIndia", dedent("""
         Welcome India
         9 Bis Boulevard Du Montparnasse
         75006 Paris, France.
-    """).strip()),
+    """).strip(), "wel"),
     Restaurant("WaytoIndia", dedent("""
         Way to India
         Strombeeklinde 92, 1853 Grimbergen
         Bruxelles, Belgique.
-    """).strip()),
+    """).strip(), "way"),
     Restaurant("Tara", dedent("""
         Tara
         58 Avenue du 8 mai 1945
         93150 Le Blanc Mesnil Paris, France.
-    """))
+    """), "t")
 ]
 
 
@@ -58,7 +82,140 @@ def convert_to_date(value):
     return None
 
 
+def convert_strings_to_dates(values: Series) -> np.ndarray:
+    cleaned = values.str.strip().str.replace("_", "-", regex=False)
+    # schedules repeat the same few date strings on every row, so only parse each one once
+    codes, uniques = pandas.factorize(cleaned)
+    remaining = Series(uniques, dtype=object)
+    dates = np.full(len(uniques), None, dtype=object)
+
+    for date_format in DATE_FORMATS:
+        if remaining.empty:
+            break
+        parsed = pandas.to_datetime(remaining, format=date_format, errors="coerce")
+        parsed_mask = parsed.notna()
+        dates[remaining.index[parsed_mask]] = parsed[parsed_mask].dt.date.to_numpy()
+        remaining = remaining[~parsed_mask]
+
+    for idx, value in remaining.items():
+        dates[idx] = convert_to_date(value)
+
+    return dates[codes]
+
+
+def convert_to_dates(values: Series) -> Series:
+    if pandas.api.types.is_datetime64_any_dtype(values):
+        return values.dt.date
+
+    objects = values.to_numpy(dtype=object)
+    dates = np.full(len(objects), None, dtype=object)
+
+    is_str = np.fromiter((isinstance(value, str) for value in objects), dtype=bool, count=len(objects))
+    if is_str.any():
+        dates[is_str] = convert_strings_to_dates(Series(objects[is_str], dtype=object))
+
+    # Timestamp, datetime and date values need no parsing
+    is_other = ~is_str & values.notna().to_numpy()
+    for idx in np.flatnonzero(is_other):
+        dates[idx] = convert_to_date(objects[idx])
+
+    return Series(dates, index=values.index, dtype=object)
+
+
+def categorize(values: Series) -> Series:
+    return values if isinstance(values.dtype, pandas.CategoricalDtype) else values.astype("category")
+
+
+def map_categories(values: Series, func) -> Series:
+    """
+    Applies func, which maps a Series to one of the same length, to each distinct value instead of
+    each row. Values which func maps to the same result share a category in the returned categorical.
+    """
+    values = categorize(values)
+    return spread_categories(values, func(Series(values.cat.categories, dtype=object)))
+
+
+def spread_categories(values: Series, mapped: Series) -> Series:
+    """ The categorical holding for each row of values the mapped value of its category, None is missing """
+    codes, uniques = pandas.factorize(mapped)
+    # missing values have code -1, which picks the -1 appended at the end
+    codes = np.append(codes, -1)[values.cat.codes.to_numpy()]
+    return Series(pandas.Categorical.from_codes(codes, uniques), index=values.index, name=values.name)
+
+
+def mask_categories(values: Series, func) -> np.ndarray:
+    """ Like map_categories for a func returning booleans, missing values are never selected """
+    values = categorize(values)
+    mask = np.asarray(func(Series(values.cat.categories, dtype=object)), dtype=bool)
+    return np.append(mask, False)[values.cat.codes.to_numpy()]
+
+
+def index_categories(index: pandas.Index, values: Series) -> np.ndarray:
+    """ index.get_indexer(values), looking up each distinct value once """
+    values = categorize(values)
+    return np.append(index.get_indexer(values.cat.categories), -1)[values.cat.codes.to_numpy()]
+
+
+def compact_counts(values: Series) -> Series:
+    numbers = pandas.to_numeric(values, errors="coerce")
+    # counts holding text stay as they are, the invoice formulas have to show those as errors
+    if numbers.isna().sum() != values.isna().sum():
+        return values
+    if numbers.hasnans:
+        return pandas.to_numeric(numbers, downcast="float")
+    return pandas.to_numeric(numbers, downcast="integer")
+
+
+def compact_schedule(df: DataFrame) -> DataFrame:
+    """
+    Stores the repeated text columns of the combined schedules as categoricals and the counts in
+    the smallest numeric dtype holding them, the filters below then work on category codes.
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    for column in COUNT_COLUMNS:
+        if column in df.columns:
+            df[column] = compact_counts(df[column])
+    return df
+
+
+def normalize_dmc(values: Series) -> Series:
+    return values.str.lower().str.strip().str.split().str.join(" ")
+
+
+def normalize_service_type(values: Series) -> Series:
+    return values.str.title().str.strip().str.split().str.join(" ")
+
+
+def starts_with_cancel(values: Series) -> Series:
+    # a column holding only times or numbers has no string categories for the .str accessor
+    strings = values.where(values.map(lambda value: isinstance(value, str)).astype(bool), "")
+    return strings.str.lower().str.startswith("cancel")
+
+
 def process_rates_df(updater, rates_df: DataFrame):
+    """ Processes every rates table, told apart by their Effective From, on its own """
+    if EFFECTIVE_FROM not in rates_df.columns:
+        return process_rates_table(updater, rates_df)
+
+    tables = []
+    for effective_from, table in rates_df.groupby(EFFECTIVE_FROM, dropna=False, sort=True):
+        table = table.drop(columns=EFFECTIVE_FROM)
+        sheet = "the first sheet" if pandas.isna(effective_from) else f"sheet {effective_from:%Y-%m-%d}"
+        if not (table["DMC"].str.strip() == "Default").any():
+            # the rates of the table before it keep applying, a table without them cannot be melted
+            updater(f"Default rates not found in {sheet} of the rates file, its rates are not used")
+            continue
+        table = process_rates_table(updater, table)
+        table[EFFECTIVE_FROM] = effective_from
+        tables.append(table)
+    if not tables:
+        raise ValueError("Default rates not found in any sheet of the rates file")
+    return concat(tables, ignore_index=True)
+
+
+def process_rates_table(updater, rates_df: DataFrame):
     rates_df = rates_df.rename(columns={"DMC": "Dmc Canonical"})
     rates_df["Dmc Canonical"] = rates_df["Dmc Canonical"].str.strip()
 
@@ -75,19 +232,84 @@ def process_rates_df(updater, rates_df: DataFrame):
     child_rates_df = child_rates_df.drop(columns=["Service Type"])
     rates_df = rates_df.merge(child_rates_df, on="Dmc Canonical", how="outer", suffixes=(None, " Child"))
 
-    rates_df["Dmc To Join"] = rates_df["Dmc Canonical"].str.lower().str.strip().str.split().str.join(" ")
+    rates_df["Dmc To Join"] = normalize_dmc(rates_df["Dmc Canonical"])
 
     return rates_df
 
 
+def to_days(values) -> np.ndarray:
+    # days since the epoch, NaT becomes the smallest int64 and sorts before every date
+    return pandas.to_datetime(Series(values, dtype=object)).to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+
+class RatesIndex:
+    """
+    Processed rates compiled into a (rates table, normalized DMC, service type) lookup table. Schedule
+    rows are resolved through the integer codes of the keys instead of a merge, so the index is built
+    once and can be kept around between runs as long as the rates file does not change.
+
+    Each rates table applies from its Effective From up to the next one, the table of a row is found
+    with a binary search of its service date over the sorted start days.
+    """
+
+    KEYS = ["Dmc To Join", "Service Type"]
+
+    def __init__(self, rates_df: DataFrame, source=None):
+        self.rates_df = rates_df
+        self.source = source
+
+        if EFFECTIVE_FROM not in rates_df.columns:
+            rates_df = rates_df.assign(**{EFFECTIVE_FROM: pandas.NaT})
+        # a left merge would repeat a schedule row for each duplicate key, the first rate wins here
+        rates_df = rates_df.drop_duplicates(self.KEYS + [EFFECTIVE_FROM], ignore_index=True)
+        self.dmcs = pandas.Index(rates_df["Dmc To Join"].unique())
+        self.service_types = pandas.Index(rates_df["Service Type"].unique())
+        days = to_days(rates_df[EFFECTIVE_FROM])
+        self.starts = np.unique(days)
+        self.values = rates_df.drop(columns=self.KEYS + [EFFECTIVE_FROM])
+
+        self.positions = np.full((len(self.starts), len(self.dmcs), len(self.service_types)), -1, dtype=np.intp)
+        table_codes = self.starts.searchsorted(days)
+        dmc_codes = self.dmcs.get_indexer(rates_df["Dmc To Join"])
+        service_type_codes = self.service_types.get_indexer(rates_df["Service Type"])
+        self.positions[table_codes, dmc_codes, service_type_codes] = np.arange(len(rates_df))
+
+    def known_dmcs(self, dmcs: Series) -> np.ndarray:
+        return index_categories(self.dmcs, dmcs) >= 0
+
+    def known_service_types(self, service_types: Series) -> np.ndarray:
+        return index_categories(self.service_types, service_types) >= 0
+
+    def table_codes(self, dates: Series | None, n_rows) -> np.ndarray:
+        # without service dates the latest rates apply
+        if dates is None:
+            return np.full(n_rows, len(self.starts) - 1, dtype=np.intp)
+        # the last table starting on or before the date, -1 for dates before the first table
+        return self.starts.searchsorted(to_days(dates), side="right") - 1
+
+    def lookup(self, dmcs: Series, service_types: Series, dates: Series | None = None) -> DataFrame:
+        dmc_codes = index_categories(self.dmcs, dmcs)
+        service_type_codes = index_categories(self.service_types, service_types)
+        table_codes = self.table_codes(dates, len(dmc_codes))
+        found = (dmc_codes >= 0) & (service_type_codes >= 0) & (table_codes >= 0)
+
+        positions = np.full(len(dmc_codes), -1, dtype=np.intp)
+        positions[found] = self.positions[table_codes[found], dmc_codes[found], service_type_codes[found]]
+
+        # reindexing with -1 fills the rows without a rate with NaN, like the left merge did
+        values = self.values.reindex(positions)
+        values.index = dmcs.index
+        return values
+
+
 def filter_cancelled_tours(df: DataFrame) -> tuple[DataFrame, DataFrame]:
     if "Remarks" in df.columns:
-        cancelled_mask_1 = df["Remarks"].fillna("").str.lower().str.startswith("cancel")
+        cancelled_mask_1 = mask_categories(df["Remarks"], starts_with_cancel)
     else:
         cancelled_mask_1 = False
 
     if "Delivery" in df.columns:
-        cancelled_mask_2 = df["Delivery"].fillna("").str.lower().str.startswith("cancel")
+        cancelled_mask_2 = mask_categories(df["Delivery"], starts_with_cancel)
     else:
         cancelled_mask_2 = False
 
@@ -98,33 +320,77 @@ def filter_cancelled_tours(df: DataFrame) -> tuple[DataFrame, DataFrame]:
     return serviced_df, cancelled_df
 
 
-def filter_unknown_dmcs(df: DataFrame, rates_df: DataFrame) -> tuple[DataFrame, DataFrame]:
-    unique_dmcs = set(rates_df["Dmc To Join"].unique().tolist())
-    df["Dmc To Join"] = df["Dmc"].str.lower().str.strip().str.split().str.join(" ")
-
-    known_dmcs_mask = df["Dmc To Join"].isin(unique_dmcs)
-    known_dmcs_df = df[known_dmcs_mask]
+def add_notes(df: DataFrame, column, notes: Series) -> DataFrame:
+    """ Adds the notes to column, a row which already has a note there keeps both """
+    if not notes.notna().any():
+        return df
+    if column in df.columns:
+        previous = df[column].astype(object)
+        both = previous.notna() & notes.notna()
+        combined = previous.where(previous.notna(), notes.astype(object))
+        combined[both] = previous[both] + "; " + notes[both].astype(object)
+        notes = combined.astype("category")
+    df[column] = notes
+    return df
+
+
+def resolve_names(df: DataFrame, kind, column, known: pandas.Index, resolver: NameResolver) -> DataFrame:
+    """
+    Applies the aliases of the resolver to column, the rows they change get the original name in
+    their Alias note. The rows which stay unknown get the most similar known name as Suggestion.
+    """
+    names = categorize(df[column])
+    categories = Series(names.cat.categories, dtype=object)
+    resolved = resolver.resolve(kind, categories, known)
+    suggested = resolver.suggestions(kind, resolved, known)
+
+    aliased = resolved != categories
+    aliases = Series(None, index=categories.index, dtype=object)
+    aliases[aliased] = [f"{kind} \"{name}\" as \"{alias}\""
+                        for name, alias in zip(categories[aliased], resolved[aliased])]
+    suggestions = suggested.where(suggested.isna(), [f"{kind} \"{name}\" may be \"{match}\""
+                                                     for name, match in zip(resolved, suggested)])
+
+    df[column] = spread_categories(names, resolved)
+    df = add_notes(df, ALIAS, spread_categories(names, aliases))
+    return add_notes(df, SUGGESTION, spread_categories(names, suggestions))
+
+
+def filter_unknown_dmcs(df: DataFrame, rates: RatesIndex,
+                        resolver: NameResolver | None = None) -> tuple[DataFrame, DataFrame]:
+    df["Dmc To Join"] = map_categories(df["Dmc"], normalize_dmc)
+    if resolver is not None:
+        df = resolve_names(df, "DMC", "Dmc To Join", rates.dmcs, resolver)
+
+    known_dmcs_mask = rates.known_dmcs(df["Dmc To Join"])
+    known_dmcs_df = df[known_dmcs_mask].drop(columns=SUGGESTION, errors="ignore")
     unknown_dmcs_df = df[~known_dmcs_mask]
     return known_dmcs_df, unknown_dmcs_df
 
 
-def filter_unknown_service_types(df: DataFrame, rates_df: DataFrame) -> tuple[DataFrame, DataFrame]:
-    unique_service_types = set(rates_df["Service Type"].unique().tolist())
-    df["Service Type"] = df["Service Type"].str.title().str.strip().str.split().str.join(" ")
-    known_service_types_mask = df["Service Type"].isin(unique_service_types)
-    known_service_types_df = df[known_service_types_mask]
+def filter_unknown_service_types(df: DataFrame, rates: RatesIndex,
+                                 resolver: NameResolver | None = None) -> tuple[DataFrame, DataFrame]:
+    df["Service Type"] = map_categories(df["Service Type"], normalize_service_type)
+    if resolver is not None:
+        df = resolve_names(df, "service type", "Service Type", rates.service_types, resolver)
+    known_service_types_mask = rates.known_service_types(df["Service Type"])
+    known_service_types_df = df[known_service_types_mask].drop(columns=SUGGESTION, errors="ignore")
     unknown_service_types_df = df[~known_service_types_mask]
     return known_service_types_df, unknown_service_types_df
 
 
-def filter_unknown_rates(df: DataFrame, rates_df: DataFrame) -> tuple[DataFrame, DataFrame]:
-    df["Dmc To Join"] = df["Dmc"].str.lower().str.strip().str.split().str.join(" ")
-    df = df.merge(rates_df, how="left", on=["Dmc To Join", "Service Type"])
+def filter_unknown_rates(df: DataFrame, rates: RatesIndex) -> tuple[DataFrame, DataFrame]:
+    # already normalized by filter_unknown_dmcs in process_all
+    if "Dmc To Join" not in df.columns:
+        df["Dmc To Join"] = map_categories(df["Dmc"], normalize_dmc)
+    df = concat([df, rates.lookup(df["Dmc To Join"], df["Service Type"], df.get("Service Date Cleaned"))], axis=1)
 
+    # schedules without any price typed in have no price columns, their rows are billed at the rates
+    # like the rows of a schedule with blank prices
     if "Price Child" not in df.columns:
-        df["Price Child"] = 0
+        df["Price Child"] = np.nan
     if "Price Adult" not in df.columns:
-        df["Price Adult"] = 0
+        df["Price Adult"] = np.nan
 
     unknown_mask = (df["Rate"].isna() | df["Rate"].isnull()) & df["Price Adult"].isna() & df["Price Child"].isna()
     unknown_df = df.loc[unknown_mask]
@@ -137,7 +403,7 @@ def filter_unknown_rates(df: DataFrame, rates_df: DataFrame) -> tuple[DataFrame,
 
 
 def filter_unknown_dates(df: DataFrame) -> tuple[DataFrame, DataFrame]:
-    df["Service Date Cleaned"] = df["Service Date"].apply(convert_to_date)
+    df["Service Date Cleaned"] = convert_to_dates(df["Service Date"])
     invalid_date_mask = df["Service Date Cleaned"].isnull()
     invalid_dates_df = df[invalid_date_mask]
     valid_dates_df = df[~invalid_date_mask]
@@ -153,6 +419,94 @@ def filter_missing_counts(df: DataFrame) -> tuple[DataFrame, DataFrame]:
     return valid_counts_df, missing_counts_df
 
 
+class TourIndex:
+    """
+    The schedule file, by path, each tour key was first billed from. The files of a run give up
+    their tours before the run claims them anew, so a tour removed from a file or no longer billed
+    from it can be billed from another one.
+    """
+
+    def __init__(self, files: dict[str, list[int]] | None = None):
+        self.files = files or {}
+        self.owners = {key: path for path, keys in self.files.items() for key in keys}
+        # path of each file released this run by its File Name, the rows only carry the latter
+        self.paths = {}
+
+    def release(self, files):
+        """ Gives up the tours of the files read this run, also of those whose rows get filtered out """
+        for file in files:
+            path = os.path.abspath(file)
+            self.paths[os.path.basename(path)] = path
+            for key in self.files.pop(path, ()):
+                del self.owners[key]
+
+    def claim(self, keys: np.ndarray, file_names: Series) -> tuple[np.ndarray, np.ndarray]:
+        """ Returns the paths of the file owning each key and of the row's file, which differ for duplicates """
+        # files which were not released, like when processing frames directly, are known by name only
+        file_names = Series(file_names.to_numpy(dtype=object))
+        paths = file_names.map(self.paths).fillna(file_names)
+
+        # python ints, like the keys loaded from json
+        keys = Series(keys.tolist(), dtype=object)
+        # within the rows claimed together, the first file a key appears in owns it
+        first = paths.groupby(keys, sort=False).transform("first")
+        owners = keys.map(self.owners)
+        unclaimed = owners.isna()
+        for key, path in zip(keys[unclaimed], first[unclaimed]):
+            if key not in self.owners:
+                self.owners[key] = path
+                self.files.setdefault(path, []).append(key)
+        return owners.fillna(first).to_numpy(dtype=object), paths.to_numpy(dtype=object)
+
+
+def schedule_label(path) -> str:
+    # the month folder tells apart schedules of the same day in different months
+    return os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+
+
+def filter_possible_duplicates(df: DataFrame, tours: TourIndex | None = None) -> tuple[DataFrame, DataFrame]:
+    if "Tour Code" not in df.columns:
+        return df, df.iloc[:0]
+
+    tours = TourIndex() if tours is None else tours
+    keyed_mask = ~df["Tour Code"].isin(MISSING_TOUR_CODES).to_numpy()
+    keyed_df = df[keyed_mask]
+    keys = pandas.util.hash_pandas_object(keyed_df[DUPLICATE_KEY], index=False).to_numpy()
+    owners, paths = tours.claim(keys, keyed_df["File Name"])
+
+    duplicates_mask = keyed_mask.copy()
+    duplicates_mask[keyed_mask] = owners != paths
+    possible_duplicates_df = df[duplicates_mask]
+    possible_duplicates_df["Duplicate Of"] = [schedule_label(owner) for owner in owners[owners != paths]]
+    return df[~duplicates_mask], possible_duplicates_df
+
+
+def excel_number(values: Series) -> Series:
+    # blank cells count as 0 in the invoice formulas while text makes them fail, hence NaN
+    return pandas.to_numeric(values, errors="coerce").where(values.notna(), 0)
+
+
+def add_totals(df: DataFrame) -> DataFrame:
+    """ Adds the Total of each row, the value the invoice formula =D*F + E*G evaluates to """
+    df["Total"] = (excel_number(df["Adult"]) * excel_number(df["Price Adult"])
+                   + excel_number(df["Children"]) * excel_number(df["Price Child"]))
+    return df
+
+
+def summarize_invoices(serviced_df: DataFrame) -> DataFrame:
+    """ One row per invoice with its tour and pax counts, grand total and the tours billed through an alias """
+    aliased = serviced_df[ALIAS].notna() if ALIAS in serviced_df.columns else False
+    summary_df = serviced_df.assign(Aliased=aliased).groupby("Dmc Canonical").agg(
+        Tours=("Total", "size"),
+        Adults=("Adult", lambda values: excel_number(values).sum()),
+        Children=("Children", lambda values: excel_number(values).sum()),
+        Total=("Total", "sum"),
+        **{"Rows Without Total": ("Total", lambda values: int(values.isna().sum())),
+           "Aliased Tours": ("Aliased", "sum")},
+    )
+    return summary_df.rename_axis("Dmc").reset_index()
+
+
 def fixup_invalid_df(invalid_df: DataFrame, reason: str) -> DataFrame | None:
     invalid_df = invalid_df.dropna(axis=1, how="all")
     if invalid_df.empty:
@@ -162,52 +516,156 @@ def fixup_invalid_df(invalid_df: DataFrame, reason: str) -> DataFrame | None:
     return invalid_df
 
 
-def process(restaurant: Restaurant, from_date, to_date, rates_df: DataFrame, df: DataFrame, not_found_df: DataFrame,
-            typos_df: DataFrame) -> tuple[DataFrame, DataFrame, DataFrame]:
-    df = df[df["Restaurant"] == restaurant.name]
-    if "Tour Code" in df.columns:
-        df["Tour Code"] = df["Tour Code"].astype("str").str.strip()
+def partition_by_restaurant(df: DataFrame, names: list[str]) -> dict[str, DataFrame]:
+    groups = dict(tuple(df.groupby("Restaurant", sort=False, observed=True))) if not df.empty else {}
+    return {name: groups.get(name, df.iloc[:0]) for name in names}
 
-    df, unknown_dates_df = filter_unknown_dates(df)
-    df = df.loc[(df["Service Date Cleaned"] >= from_date) & (df["Service Date Cleaned"] <= to_date)]
-
-    df, cancelled_df = filter_cancelled_tours(df)
-    df, unknown_dmcs_df = filter_unknown_dmcs(df, rates_df)
-    df, unknown_service_types_df = filter_unknown_service_types(df, rates_df)
-    df, unknown_rates_df = filter_unknown_rates(df, rates_df)
-    df, missing_counts_df = filter_missing_counts(df)
-
-    restaurant_not_found_df = not_found_df.loc[not_found_df["Restaurant"] == restaurant.name]
-    restaurant_not_found_df = fixup_invalid_df(restaurant_not_found_df, "Sheet for restaurant not found")
-
-    restaurant_typos_df = typos_df.loc[typos_df["Restaurant"] == restaurant.name]
-    restaurant_typos_df = fixup_invalid_df(restaurant_typos_df, "Sheetname for restaurant has a typo")
 
+def build_invalid_df(not_found_df: DataFrame, typos_df: DataFrame, unknown_dates_df: DataFrame,
+                     unknown_dmcs_df: DataFrame, unknown_service_types_df: DataFrame, unknown_rates_df: DataFrame,
+                     missing_counts_df: DataFrame, possible_duplicates_df: DataFrame) -> DataFrame:
+    not_found_df = fixup_invalid_df(not_found_df, "Sheet for restaurant not found")
+    typos_df = fixup_invalid_df(typos_df, "Sheetname for restaurant has a typo")
     unknown_dates_df = fixup_invalid_df(unknown_dates_df, "Service date could not be parsed")
     unknown_dmcs_df = fixup_invalid_df(unknown_dmcs_df, "DMC is not known")
     unknown_service_types_df = fixup_invalid_df(unknown_service_types_df, "Service type is not known")
     unknown_rates_df = fixup_invalid_df(unknown_rates_df, "Service type is unknown and Price Adult/Child not defined")
     missing_counts_df = fixup_invalid_df(missing_counts_df, "Both adult and children count is missing")
+    possible_duplicates_df = fixup_invalid_df(possible_duplicates_df, "Possible duplicate")
 
     invalid_dfs = []
-    if restaurant_not_found_df is not None and not restaurant_not_found_df.empty:
-        invalid_dfs.append(restaurant_not_found_df)
-    if restaurant_typos_df is not None and not restaurant_typos_df.empty:
-        invalid_dfs.append(restaurant_typos_df)
+    if not_found_df is not None and not not_found_df.empty:
+        invalid_dfs.append(not_found_df)
+    if typos_df is not None and not typos_df.empty:
+        invalid_dfs.append(typos_df)
     if unknown_dates_df is not None and not unknown_dates_df.empty:
         invalid_dfs.append(unknown_dates_df)
     if unknown_dmcs_df is not None and not unknown_dmcs_df.empty:
         invalid_dfs.append(unknown_dmcs_df)
     if unknown_service_types_df is not None and not unknown_service_types_df.empty:
         invalid_dfs.append(unknown_service_types_df)
-    if unknown_rates_df is not None and unknown_rates_df.empty:
+    if unknown_rates_df is not None and not unknown_rates_df.empty:
         invalid_dfs.append(unknown_rates_df)
     if missing_counts_df is not None and not missing_counts_df.empty:
         invalid_dfs.append(missing_counts_df)
+    if possible_duplicates_df is not None and not possible_duplicates_df.empty:
+        invalid_dfs.append(possible_duplicates_df)
 
     if invalid_dfs:
-        invalid_df = concat(invalid_dfs, ignore_index=True)
-    else:
-        invalid_df = DataFrame()
+        return concat(invalid_dfs, ignore_index=True)
+    return DataFrame()
+
+
+def filter_all(restaurants: list[Restaurant], from_date, to_date, rates: RatesIndex,
+               df: DataFrame, resolver: NameResolver | None = None,
+               tours: TourIndex | None = None) -> dict[str, list[DataFrame]]:
+    # every filter below works row by row or, for duplicates, by a key including the restaurant, so
+    # running them once over all the restaurants and splitting the results afterwards gives the same
+    # rows as filtering each restaurant separately
+    names = [restaurant.name for restaurant in restaurants]
+    df = df[df["Restaurant"].isin(names)]
+    if "Tour Code" in df.columns:
+        df["Tour Code"] = df["Tour Code"].astype("str").str.strip()
 
-    return df, cancelled_df, invalid_df
+    with span("filter", "filter_unknown_dates", rows=len(df)):
+        df, unknown_dates_df = filter_unknown_dates(df)
+        df = df.loc[(df["Service Date Cleaned"] >= from_date) & (df["Service Date Cleaned"] <= to_date)]
+
+    with span("filter", "filter_cancelled_tours", rows=len(df)):
+        df, cancelled_df = filter_cancelled_tours(df)
+    with span("filter", "filter_unknown_dmcs", rows=len(df)):
+        df, unknown_dmcs_df = filter_unknown_dmcs(df, rates, resolver)
+    with span("filter", "filter_unknown_service_types", rows=len(df)):
+        df, unknown_service_types_df = filter_unknown_service_types(df, rates, resolver)
+    with span("filter", "filter_unknown_rates", rows=len(df)):
+        df, unknown_rates_df = filter_unknown_rates(df, rates)
+    with span("filter", "filter_missing_counts", rows=len(df)):
+        df, missing_counts_df = filter_missing_counts(df)
+    with span("filter", "filter_possible_duplicates", rows=len(df)):
+        df, possible_duplicates_df = filter_possible_duplicates(df, tours)
+    with span("totals", "add_totals", rows=len(df)):
+        df = add_totals(df)
+
+    with span("partition", "partition_by_restaurant", rows=len(df)):
+        partitions = [
+            partition_by_restaurant(frame, names)
+            for frame in (df, cancelled_df, unknown_dates_df, unknown_dmcs_df, unknown_service_types_df,
+                          unknown_rates_df, missing_counts_df, possible_duplicates_df)
+        ]
+    return {name: [partition[name] for partition in partitions] for name in names}
+
+
+def process_all(restaurants: list[Restaurant], from_date, to_date, rates: RatesIndex, df: DataFrame | None,
+                not_found_df: DataFrame, typos_df: DataFrame, resolver: NameResolver | None = None,
+                tours: TourIndex | None = None) -> dict[str, tuple[DataFrame, DataFrame, DataFrame]]:
+    names = [restaurant.name for restaurant in restaurants]
+    # without any schedule rows in the range the sheets not found and the typos are still reported
+    filtered = {}
+    if df is not None and not df.empty:
+        filtered = filter_all(restaurants, from_date, to_date, rates, df, resolver, tours)
+    not_found = partition_by_restaurant(not_found_df, names)
+    typos = partition_by_restaurant(typos_df, names)
+
+    results = {}
+    for name in names:
+        serviced_df, cancelled_df, *invalid_parts = filtered.get(name, [DataFrame()] * 8)
+        results[name] = serviced_df, cancelled_df, build_invalid_df(not_found[name], typos[name], *invalid_parts)
+    return results
+
+
+def concat_parts(parts: list[DataFrame]) -> DataFrame:
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return DataFrame()
+    # a categorical column with only missing values in one chunk has categories of another dtype
+    # than the other chunks, concatenating it as is lets pandas guess the dtype from it
+    columns = list(dict.fromkeys(column for part in parts for column in part.columns))
+    return concat([part.dropna(axis=1, how="all") for part in parts], ignore_index=True).reindex(columns=columns)
+
+
+def process_chunks(restaurants: list[Restaurant], from_date, to_date, rates: RatesIndex, chunks,
+                   serviced_columns: list[str] | None = None, resolver: NameResolver | None = None,
+                   tours: TourIndex | None = None) -> dict[str, tuple[DataFrame, DataFrame, DataFrame]]:
+    """
+    Same as process_all for schedules that arrive as (df, not_found_df, typos_df) chunks. Only the
+    filtered rows are kept between chunks, and with serviced_columns only those columns of the
+    serviced rows, which bounds memory to what is eventually written instead of the whole season.
+    """
+    names = [restaurant.name for restaurant in restaurants]
+    # one index for all chunks, a tour copied into files of different chunks is a duplicate too
+    tours = TourIndex() if tours is None else tours
+    # not found, typos, serviced, cancelled followed by the other invalid reasons in filter_all order
+    buffers = {name: [[] for _ in range(10)] for name in names}
+
+    for df, not_found_df, typos_df in chunks:
+        not_found = partition_by_restaurant(not_found_df, names)
+        typos = partition_by_restaurant(typos_df, names)
+        filtered = {}
+        if not df.empty:
+            filtered = filter_all(restaurants, from_date, to_date, rates, df, resolver, tours)
+
+        for name in names:
+            buffers[name][0].append(not_found[name])
+            buffers[name][1].append(typos[name])
+            if name not in filtered:
+                continue
+
+            serviced_df, *other_parts = filtered[name]
+            if serviced_columns is not None:
+                # columns like the Alias notes only exist when some row has one
+                serviced_df = serviced_df.filter(items=serviced_columns)
+            for idx, part in enumerate([serviced_df, *other_parts], start=2):
+                buffers[name][idx].append(part)
+
+    results = {}
+    for name in names:
+        not_found_df, typos_df, serviced_df, cancelled_df, *invalid_parts = [
+            concat_parts(parts) for parts in buffers[name]
+        ]
+        results[name] = serviced_df, cancelled_df, build_invalid_df(not_found_df, typos_df, *invalid_parts)
+    return results
+
+
+def process(restaurant: Restaurant, from_date, to_date, rates: RatesIndex, df: DataFrame, not_found_df: DataFrame,
+            typos_df: DataFrame) -> tuple[DataFrame, DataFrame, DataFrame]:
+    return process_all([restaurant], from_date, to_date, rates, df, not_found_df, typos_df)[restaurant.name]
@@ -1,16 +1,35 @@
 import sys
 import os
+import threading
+import time
 import traceback
-from datetime import date, datetime
+import logging
+from collections import deque
+from datetime import date
+from logging.handlers import RotatingFileHandler
 
 from PyQt5.QtWidgets import QWidget, QPushButton, QVBoxLayout, QFileDialog, QDateEdit, QLineEdit, \
-    QHBoxLayout, QFormLayout, QPlainTextEdit, QDialog, QDesktopWidget
-from PyQt5.QtCore import QDir, QObject, pyqtSignal, QSettings, QThreadPool, QRunnable, pyqtSlot
+    QHBoxLayout, QFormLayout, QPlainTextEdit, QDialog, QDesktopWidget, QSpinBox, QCheckBox, QTableWidget, \
+    QTableWidgetItem, QHeaderView, QAbstractItemView, QProgressBar
+from PyQt5.QtCore import QDir, QObject, pyqtSignal, QSettings, QThreadPool, QRunnable, pyqtSlot, QTimer, \
+    QStandardPaths
 from PyQt5.QtGui import QIcon
 from dateutil.relativedelta import relativedelta
 
-from .core import RESTAURANTS, process, process_rates_df
-from .io import read_all_files, write_auxiliary_df, write_all_invoices, read_rates_file
+from .jobs import Job, JobCancelled
+
+# messages are shown in batches, a signal and a repaint per message slowed down runs with many files
+LOG_FLUSH_INTERVAL_MS = 100
+# older lines are dropped from the dialog, the log file keeps everything
+LOG_MAX_BLOCKS = 5000
+LOG_FILE_NAME = "invoice-generator.log"
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+# how often the month folders are scanned for new schedules when reading in the background is on
+WATCH_INTERVAL_MS = 30 * 1000
+
+# app.pipeline pulls in pandas, numpy and openpyxl which take seconds to import in the frozen
+# executable, so it is only imported from worker threads once the window is already visible
 
 
 def resource_path(relative_path):
@@ -20,6 +39,25 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+def create_file_logger():
+    logger = logging.getLogger("invoice_generator")
+    if logger.handlers:
+        return logger
+
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    directory = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(os.path.join(directory, LOG_FILE_NAME), maxBytes=LOG_FILE_MAX_BYTES,
+                                      backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    except OSError:
+        handler = logging.NullHandler()
+    logger.addHandler(handler)
+    return logger
+
+
 class WorkerSignals(QObject):
     """
     Defines the signals available from a running worker thread.
@@ -29,50 +67,80 @@ class WorkerSignals(QObject):
     to hold the signals is the simplest solution.
     """
     finished = pyqtSignal()
-    progress = pyqtSignal(str)
+    rates_loaded = pyqtSignal(object)
+    profiled = pyqtSignal(object)
+    # stage, done, total
+    step = pyqtSignal(str, int, int)
 
 
-class Worker(QRunnable):
+class WarmupWorker(QRunnable):
+    """
+    Imports the data libraries in the background so that the first click on Generate does not
+    have to wait for them.
+    """
+
+    @pyqtSlot()
+    def run(self):
+        start = time.perf_counter()
+        from . import pipeline  # noqa: F401
+        if sys.stderr is not None:
+            print(f"Data libraries loaded in {(time.perf_counter() - start) * 1000:.0f} ms", file=sys.stderr)
+
+
+class WatchWorker(QRunnable):
+    """
+    Reads the schedules which changed since the last poll into the cache, see app.watch. Setting
+    stop ends the poll after the file being read, generating invoices does so and waits for it.
+    """
 
-    def __init__(self, input_directory, from_date, to_date):
+    def __init__(self, input_directory, reader="openpyxl", log=print):
         super().__init__()
         self.input_directory = input_directory
-        self.from_date = from_date
-        self.to_date = to_date
+        self.reader = reader
+        self.log = log
+        self.stop = threading.Event()
         self.signals = WorkerSignals()
 
     @pyqtSlot()
     def run(self):
-        # TODO: use logger object instead of passing around updater
-        updater = lambda x: self.signals.progress.emit(x)
         try:
-            df, not_found_df, typos_df = read_all_files(updater, self.from_date, self.to_date, self.input_directory)
-            rates_df = read_rates_file(self.input_directory)
-            rates_df = process_rates_df(updater, rates_df)
-
-            suffix = datetime.now().strftime("%Y-%m-%d %H-%M-%S")
-
-            for restaurant in RESTAURANTS:
-                serviced_df, cancelled_df, invalid_df = process(restaurant, self.from_date, self.to_date, rates_df, df, not_found_df, typos_df)
+            from .watch import ScheduleWatcher
+            ScheduleWatcher(self.log, self.input_directory, self.reader, stop=self.stop).poll()
+        except Exception:
+            self.log(traceback.format_exc())
+        finally:
+            self.signals.finished.emit()
 
-                restaurant_base_path = os.path.join(self.input_directory, restaurant.name, suffix)
-                if not (cancelled_df.empty and serviced_df.empty and invalid_df.empty):
-                    os.makedirs(restaurant_base_path, exist_ok=True)
 
-                if cancelled_df.empty:
-                    updater(f"No cancelled tours for {restaurant.name}")
-                else:
-                    write_auxiliary_df(updater, restaurant_base_path, "Cancelled", cancelled_df)
+class Worker(QRunnable):
 
-                if invalid_df.empty:
-                    updater(f"No invalid tour entries for {restaurant.name}")
-                else:
-                    write_auxiliary_df(updater, restaurant_base_path, "Invalid", invalid_df)
+    def __init__(self, input_directory, from_date, to_date, workers=1, rates=None, reader="openpyxl", parquet=False,
+                 log=print):
+        super().__init__()
+        self.input_directory = input_directory
+        self.from_date = from_date
+        self.to_date = to_date
+        self.workers = workers
+        self.rates = rates
+        self.reader = reader
+        self.parquet = parquet
+        # called from the worker thread, see QLoggingDialog.log
+        self.log = log
+        self.signals = WorkerSignals()
+        self.job = Job(progress=self.signals.step.emit)
 
-                if serviced_df.empty:
-                    updater(f"No tours found for {restaurant.name}")
-                else:
-                    write_all_invoices(updater, restaurant_base_path, restaurant.address, serviced_df)
+    @pyqtSlot()
+    def run(self):
+        updater = self.log
+        try:
+            from .pipeline import generate_invoices
+            summary = generate_invoices(updater, self.input_directory, self.from_date, self.to_date,
+                                        workers=self.workers, rates=self.rates, reader=self.reader,
+                                        parquet=self.parquet, job=self.job)
+            self.signals.rates_loaded.emit(summary.rates)
+            self.signals.profiled.emit(summary.profiler)
+        except JobCancelled:
+            updater("Cancelled")
         except Exception:
             updater(traceback.format_exc())
         finally:
@@ -81,29 +149,66 @@ class Worker(QRunnable):
 
 class QLoggingDialog(QDialog):
 
-    signal = pyqtSignal(str)
-
     def __init__(self):
         super().__init__()
+        # appended from worker threads and drained by the timer on the GUI thread
+        self.pending = deque()
+        self.logger = create_file_logger()
         self.init_ui()
 
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start(LOG_FLUSH_INTERVAL_MS)
+
     def init_ui(self):
         self.widget = QPlainTextEdit()
         self.widget.setReadOnly(True)
-        self.signal.connect(self.widget.appendPlainText)
+        self.widget.setMaximumBlockCount(LOG_MAX_BLOCKS)
+
+        # per stage summary of the last run, hidden until a run finishes
+        self.profile_table = QTableWidget()
+        self.profile_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.profile_table.verticalHeader().setVisible(False)
+        self.profile_table.hide()
 
         layout = QVBoxLayout()
-        layout.addWidget(self.widget)
+        layout.addWidget(self.widget, stretch=3)
+        layout.addWidget(self.profile_table, stretch=1)
         self.setLayout(layout)
 
         self.setWindowTitle("Logs")
         self.setMinimumSize(500, 300)
 
     def log(self, message):
-        self.signal.emit(message)
+        """ Safe to call from any thread, the message shows up with the next flush """
+        self.pending.append(message)
+        self.logger.info(message)
+
+    def flush(self):
+        # only this thread pops, so the length checked here can only grow while draining
+        messages = [self.pending.popleft() for _ in range(len(self.pending))]
+        if messages:
+            self.widget.appendPlainText("\n".join(messages))
 
     def clear_log(self):
+        self.pending.clear()
         self.widget.clear()
+        self.profile_table.clear()
+        self.profile_table.hide()
+
+    def show_profile(self, profiler):
+        from .profiling import SUMMARY_COLUMNS
+        rows = profiler.summary_rows()
+        self.profile_table.setColumnCount(len(SUMMARY_COLUMNS))
+        self.profile_table.setHorizontalHeaderLabels(SUMMARY_COLUMNS)
+        self.profile_table.setRowCount(len(rows))
+        for row_idx, row in enumerate(rows):
+            for column_idx, value in enumerate(row):
+                self.profile_table.setItem(row_idx, column_idx, QTableWidgetItem(value))
+        self.profile_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.profile_table.show()
+        if profiler.peak_rss is not None:
+            self.log(profiler.format_peak_rss())
 
 
 class InvoiceGeneratorApp(QWidget):
@@ -117,11 +222,33 @@ class InvoiceGeneratorApp(QWidget):
         else:
             self.existing_path = ""
 
+        # leave a core for the window, the pipeline's process pools use the rest
+        self.workers = int(self.settings.value("workers", max(1, (os.cpu_count() or 1) - 1)))
+        self.reader = self.settings.value("reader", "openpyxl")
+        self.parquet = self.settings.value("parquet", "false") == "true"
+        self.watch = self.settings.value("watch", "false") == "true"
+        # compiled rates from the last run, reused while Rates.xlsx is unchanged
+        self.rates = None
+
+        # one run at a time plus the warmup import and a background poll, the work itself happens in
+        # process pools
         self.threadpool = QThreadPool()
+        self.threadpool.setMaxThreadCount(3)
+        self.worker = None
+        self.watch_worker = None
 
         self.init_ui()
         self.check_generate_button_state()
 
+        # start once the event loop runs, i.e. after the window has been painted
+        QTimer.singleShot(0, lambda: self.threadpool.start(WarmupWorker()))
+
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setInterval(WATCH_INTERVAL_MS)
+        self.watch_timer.timeout.connect(self.poll_schedules)
+        if self.watch:
+            self.watch_timer.start()
+
     def init_ui(self):
         self.icon = QIcon(resource_path("./icon.png"))
         self.setWindowIcon(self.icon)
@@ -156,18 +283,52 @@ class InvoiceGeneratorApp(QWidget):
         self.from_date_selector.dateChanged.connect(self.choose_to_date)
         self.to_date_selector.setCalendarPopup(True)
 
+        self.workers_selector = QSpinBox()
+        self.workers_selector.setRange(1, os.cpu_count() or 1)
+        self.workers_selector.setValue(self.workers)
+        self.workers_selector.valueChanged.connect(self.choose_workers)
+
+        self.fast_reader_checkbox = QCheckBox("Use the fast schedule reader")
+        self.fast_reader_checkbox.setChecked(self.reader == "fast")
+        self.fast_reader_checkbox.toggled.connect(self.choose_reader)
+
+        self.parquet_checkbox = QCheckBox("Also export a Parquet dataset")
+        self.parquet_checkbox.setChecked(self.parquet)
+        self.parquet_checkbox.toggled.connect(self.choose_parquet)
+
+        self.watch_checkbox = QCheckBox("Read new schedules in the background")
+        self.watch_checkbox.setChecked(self.watch)
+        self.watch_checkbox.toggled.connect(self.choose_watch)
+
         self.generate_button = QPushButton("Generate Invoice")
         self.generate_button.clicked.connect(self.generate_invoice)
         self.generate_button.setEnabled(False)
 
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_generation)
+        self.cancel_button.setEnabled(False)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setValue(0)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.generate_button, stretch=1)
+        buttons_layout.addWidget(self.cancel_button)
+
         form_layout = QFormLayout()
         form_layout.addRow("Schedules:", input_dir_layout)
         form_layout.addRow("From Date:", self.from_date_selector)
         form_layout.addRow("To Date:", self.to_date_selector)
+        form_layout.addRow("Workers:", self.workers_selector)
+        form_layout.addRow("Reader:", self.fast_reader_checkbox)
+        form_layout.addRow("Export:", self.parquet_checkbox)
+        form_layout.addRow("Background:", self.watch_checkbox)
 
         layout = QVBoxLayout()
         layout.addLayout(form_layout)
-        layout.addWidget(self.generate_button)
+        layout.addLayout(buttons_layout)
+        layout.addWidget(self.progress_bar)
 
         self.setLayout(layout)
 
@@ -181,6 +342,45 @@ class InvoiceGeneratorApp(QWidget):
     def choose_to_date(self, to_date):
         self.check_generate_button_state()
 
+    def choose_workers(self, workers):
+        self.workers = workers
+        self.settings.setValue("workers", workers)
+
+    def choose_reader(self, fast):
+        self.reader = "fast" if fast else "openpyxl"
+        self.settings.setValue("reader", self.reader)
+
+    def choose_parquet(self, parquet):
+        self.parquet = parquet
+        self.settings.setValue("parquet", "true" if parquet else "false")
+
+    def choose_watch(self, watch):
+        self.watch = watch
+        self.settings.setValue("watch", "true" if watch else "false")
+        if watch:
+            self.watch_timer.start()
+            self.poll_schedules()
+        else:
+            self.watch_timer.stop()
+            if self.watch_worker is not None:
+                self.watch_worker.stop.set()
+
+    def poll_schedules(self):
+        input_directory = self.input_dir_line_edit.text()
+        # a run reads the schedules itself, and one poll at a time is enough
+        if not input_directory or self.worker is not None or self.watch_worker is not None:
+            return
+
+        watch_worker = self.watch_worker = WatchWorker(input_directory, self.reader, log=self.logging_dialog.log)
+        watch_worker.signals.finished.connect(self.finish_poll)
+        self.threadpool.start(watch_worker)
+
+    def finish_poll(self):
+        self.watch_worker = None
+        # a run which was waiting for the poll to stop, see generate_invoice
+        if self.worker is not None:
+            self.threadpool.start(self.worker)
+
     def choose_input_directory(self):
         directory = QFileDialog.getExistingDirectory(self, "Choose directory", self.existing_path or QDir.homePath())
         if directory:
@@ -196,20 +396,42 @@ class InvoiceGeneratorApp(QWidget):
 
         self.generate_button.setEnabled(input_dir_selected and from_date_selected and to_date_selected)
 
-    def report_progress(self, message):
-        self.logging_dialog.log(message)
+    def store_rates(self, rates):
+        self.rates = rates
+
+    def report_step(self, stage, done, total):
+        label = {"read": "Reading schedules", "write": "Writing invoices"}.get(stage, stage)
+        self.progress_bar.setMaximum(max(total, 1))
+        self.progress_bar.setValue(done if total else 1)
+        self.progress_bar.setFormat(f"{label} {done}/{total}")
+
+    def cancel_generation(self):
+        if self.worker is not None:
+            self.worker.job.cancel()
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.setText("Cancelling...")
 
     def disable_ui(self):
         self.input_dir_button.setEnabled(False)
         self.from_date_selector.setEnabled(False)
         self.to_date_selector.setEnabled(False)
+        self.workers_selector.setEnabled(False)
+        self.fast_reader_checkbox.setEnabled(False)
+        self.parquet_checkbox.setEnabled(False)
         self.generate_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
 
     def enable_ui(self):
         self.input_dir_button.setEnabled(True)
         self.from_date_selector.setEnabled(True)
         self.to_date_selector.setEnabled(True)
+        self.workers_selector.setEnabled(True)
+        self.fast_reader_checkbox.setEnabled(True)
+        self.parquet_checkbox.setEnabled(True)
         self.generate_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.setText("Cancel")
+        self.worker = None
 
     def generate_invoice(self):
         input_directory = self.input_dir_line_edit.text()
@@ -222,8 +444,20 @@ class InvoiceGeneratorApp(QWidget):
         self.logging_dialog.show()
         self.logging_dialog.raise_()
 
-        worker = Worker(input_directory, from_date, to_date)
-        worker.signals.progress.connect(self.report_progress)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("Starting")
+
+        worker = self.worker = Worker(input_directory, from_date, to_date, self.workers, self.rates, self.reader,
+                                      self.parquet, log=self.logging_dialog.log)
+        worker.signals.step.connect(self.report_step)
+        worker.signals.rates_loaded.connect(self.store_rates)
+        worker.signals.profiled.connect(self.logging_dialog.show_profile)
         worker.signals.finished.connect(self.enable_ui)
 
+        # both load and save the schedule cache index, whichever saved last would drop the entries of
+        # the other, so the run only starts once the poll has stopped after its current file
+        if self.watch_worker is not None:
+            self.watch_worker.stop.set()
+            self.progress_bar.setFormat("Waiting for the background read")
+            return
         self.threadpool.start(worker)
@@ -1,71 +1,146 @@
+import hashlib
+import json
 import os
+import shutil
 import traceback
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
+from functools import partial
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 from openpyxl.cell import WriteOnlyCell
 from openpyxl.reader.excel import load_workbook
-from openpyxl.styles import Font, Alignment, Border, Side
+from openpyxl.styles import Font, Alignment, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
 from openpyxl.utils import get_column_letter
-from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.workbook import Workbook
 from pandas import concat, DataFrame
 
-from .core import RESTAURANTS
+from .core import EFFECTIVE_FROM, RESTAURANTS, TourIndex, compact_schedule, concat_parts
+from .profiling import Span, measure, record, span
+from .xlsx import FastWorkbook
 
 MAX_ROWS = 50
 MAX_COLS = 25
+# "fast" streams the sheet xml directly and falls back to openpyxl for workbooks it cannot handle
+READERS = ["openpyxl", "fast"]
 FONT_BOLD = Font(bold=True)
 ALIGNMENT_CENTER = Alignment(horizontal="center", vertical="center")
+ALIGNMENT_WRAP_TOP = Alignment(wrapText=True, vertical="top")
+ALIGNMENT_CENTER_TOP = Alignment(horizontal="center", vertical="top")
 SIDE_BLACK = Side(border_style="thin", color="000000")
 BORDER_BLACK = Border(top=SIDE_BLACK, bottom=SIDE_BLACK, left=SIDE_BLACK, right=SIDE_BLACK)
-
-
-def get_directories(from_date: date, to_date: date):
-    months_done = set()
-    directories = []
+INVOICE_COLUMNS = ["Tour Code", "Service Date", "Service Type",
+                   "Adult", "Children", "Price Adult", "Price Child"]
+# named styles registered once per invoice workbook, assigning one to a cell copies a single style
+# array instead of looking up its border, alignment and font separately
+STYLE_CELL = "Invoice Cell"
+STYLE_DATE = "Invoice Date"
+STYLE_HEADER = "Invoice Header"
+STYLE_EMPTY = "Invoice Empty"
+INVOICE_STYLES = {
+    STYLE_CELL: dict(font=DEFAULT_FONT, border=BORDER_BLACK, alignment=ALIGNMENT_CENTER),
+    STYLE_DATE: dict(font=DEFAULT_FONT, border=BORDER_BLACK, alignment=ALIGNMENT_CENTER, number_format="dd mmm"),
+    STYLE_HEADER: dict(font=FONT_BOLD, border=BORDER_BLACK, alignment=ALIGNMENT_CENTER),
+    STYLE_EMPTY: dict(font=DEFAULT_FONT, border=BORDER_BLACK),
+}
+# rows of the cancelled and invalid reports converted to python values at a time
+AUXILIARY_BATCH_ROWS = 10_000
+INVALID_TITLE_CHARACTERS = set("[]:*?/\\")
+PARQUET_DIRECTORY = "Parquet"
+PARQUET_KINDS = ["serviced", "cancelled", "invalid"]
+PARQUET_PARTITIONS = ["Restaurant", "Month"]
+# the directory pyarrow writes the rows of a missing partition value to
+PARQUET_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+# typed as numbers in every run so that the partitions of different runs share one schema,
+# all other columns except the cleaned date are stored as text
+PARQUET_NUMERIC_COLUMNS = ["Adult", "Children", "Price Adult", "Price Child", "Rate", "Rate Child", "Total"]
+INVOICE_MANIFEST = ".manifest.json"
+# bump whenever the layout written by write_invoice changes so that old invoices are not reused
+INVOICE_VERSION = 1
+
+
+def get_months(from_date: date, to_date: date) -> dict[str, list[date]]:
+    # maps the full and the abbreviated month folder names to the first day of each month in the
+    # range they can hold, a range longer than a year has the same folder for two months
+    months = {}
 
     delta = relativedelta(months=1, day=1)
     current_date = from_date
     while current_date <= to_date:
-        month = current_date.strftime("%B")
-        if month not in months_done:
-            directories.append(month)
-            months_done.add(month)
-
-        month = current_date.strftime("%b")
-        if month not in months_done:
-            directories.append(month)
-            months_done.add(month)
+        month = current_date.replace(day=1)
+        for directory in (current_date.strftime("%B"), current_date.strftime("%b")):
+            months.setdefault(directory, [])
+            if month not in months[directory]:
+                months[directory].append(month)
         current_date += delta
 
-    return directories
+    return months
 
 
-def list_files(updater, from_date, to_date, base_dir):
-    directories = get_directories(from_date, to_date)
-    updater(f"Searching for directories: {', '.join(directories)}")
+def get_directories(from_date: date, to_date: date):
+    return list(get_months(from_date, to_date))
 
-    files = []
-    for directory in get_directories(from_date, to_date):
-        dir_path = os.path.join(base_dir, directory)
-        if not os.path.exists(dir_path):
+
+def parse_schedule_day(file) -> int | None:
+    if not (file.endswith(".xlsx") or file.endswith("xls")):
+        return None
+
+    parts = file.replace("-", " ").split()
+    try:
+        return int(parts[0])
+    except ValueError:
+        return None
+
+
+def scan_schedule_directory(dir_path) -> dict[str, int]:
+    days = {}
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            day = parse_schedule_day(entry.name)
+            if day is not None and entry.is_file():
+                days[entry.name] = day
+    return days
+
+
+def schedule_in_range(months: list[date], day, from_date, to_date):
+    for month in months:
+        try:
+            schedule_date = month.replace(day=day)
+        except ValueError:
             continue
+        if from_date <= schedule_date <= to_date:
+            return True
+    return False
 
-        for file in os.listdir(dir_path):
-            if not (file.endswith(".xlsx") or file.endswith("xls")):
-                continue
 
-            parts = file.replace("-", " ").split()
-            try:
-                day = int(parts[0])
-            except ValueError:
-                continue
+def list_files(updater, from_date, to_date, base_dir, index=None):
+    months = get_months(from_date, to_date)
+    updater(f"Searching for directories: {', '.join(months)}")
 
-            files.append(f"{base_dir}/{directory}/{file}")
+    files = []
+    for directory, directory_months in months.items():
+        dir_path = os.path.join(base_dir, directory)
+        if index is not None:
+            days = index.days(dir_path)
+        elif os.path.isdir(dir_path):
+            days = scan_schedule_directory(dir_path)
+        else:
+            days = None
+        if days is None:
+            continue
+
+        # schedules of days outside the range are not even opened
+        for file, day in days.items():
+            if schedule_in_range(directory_months, day, from_date, to_date):
+                files.append(f"{base_dir}/{directory}/{file}")
 
+    if index is not None:
+        index.save()
     return files
 
 
@@ -96,23 +171,30 @@ def read_sheet(sheet):
     return header, data or None
 
 
-def read_file(file) -> tuple[DataFrame | None, list[tuple], list[tuple]]:
+def read_file(file, reader="openpyxl") -> tuple[DataFrame | None, list[tuple], list[tuple]]:
     filename = os.path.basename(file)
+    if reader == "fast":
+        try:
+            with closing(FastWorkbook(file)) as workbook:
+                return read_workbook(filename, workbook)
+        except Exception:
+            # anything the fast reader cannot handle is read again through openpyxl
+            pass
+    return read_workbook(filename, load_workbook(file, read_only=True))
+
+
+def read_workbook(filename, workbook) -> tuple[DataFrame | None, list[tuple], list[tuple]]:
     not_found = []
     typos = []
     dfs = []
 
-    workbook = load_workbook(file, read_only=True)
     for restaurant in RESTAURANTS:
         sheet = None
         if restaurant.name in workbook:
             sheet = workbook[restaurant.name]
         else:
             for sheetname in workbook.sheetnames:
-                if (restaurant.name == "Dawat" and sheetname.lower().startswith("d")) or \
-                        (restaurant.name == "WelcomeIndia" and sheetname.lower().startswith("wel")) or \
-                        (restaurant.name == "WaytoIndia" and sheetname.lower().startswith("way")) or \
-                        (restaurant.name == "Tara" and sheetname.lower().startswith("t")):
+                if sheetname.lower().startswith(restaurant.sheet_prefix):
                     sheet = workbook[sheetname]
                     typos.append((filename, restaurant.name, sheetname))
                     break
@@ -140,15 +222,93 @@ def read_file(file) -> tuple[DataFrame | None, list[tuple], list[tuple]]:
     return concat(dfs, ignore_index=True), not_found, typos
 
 
-def read_all_files(updater, from_date, to_date, base_dir):
-    files = list_files(updater, from_date, to_date, base_dir)
+def schedule_name(file):
+    return "/".join(file.split("/")[-2:])
+
+
+def measure_read_file(file, reader="openpyxl"):
+    # measured where the file is read, which is a pool worker when reading in parallel
+    with measure("read_file", schedule_name(file)) as read_span:
+        result = read_file(file, reader)
+        read_span.rows = 0 if result[0] is None else len(result[0])
+    return result, read_span
+
+
+def read_files(files, workers=1, reader="openpyxl"):
+    if workers <= 1 or len(files) <= 1:
+        for file in files:
+            yield file, *measure_read_file(file, reader)
+        return
+
+    # executor.map yields results in submission order, so the merge below sees the
+    # files in the same order as the serial path regardless of which finishes first
+    chunksize = max(1, len(files) // (workers * 4))
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        results = executor.map(partial(measure_read_file, reader=reader), files, chunksize=chunksize)
+        for file, (result, read_span) in zip(files, results):
+            yield file, result, read_span
+    finally:
+        # when the caller stops early (a cancelled job) the files not started yet are dropped
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_file_results(updater, files, workers=1, cache=None, reader="openpyxl", job=None):
+    fresh_files = set()
+    if cache is not None:
+        fresh_files = {file for file in files if cache.fresh(file)}
+        updater(f"Loaded {len(fresh_files)} files from cache")
+
+    missing_files = [file for file in files if file not in fresh_files]
+    if workers > 1 and len(missing_files) > 1:
+        updater(f"Reading files using {workers} processes")
+
+    if job is not None:
+        job.start("read", len(files))
+
+    # cached results are only loaded when their turn comes so that streaming callers do not
+    # hold every file in memory, the pool results arrive in the order of missing_files
+    fresh_results = read_files(missing_files, workers, reader)
+    try:
+        for file in files:
+            if job is not None:
+                job.check()
+
+            result = None
+            if file in fresh_files:
+                with span("read_cache", schedule_name(file)):
+                    result = cache.read(file)
+            if result is None:
+                if file in fresh_files:
+                    result, read_span = measure_read_file(file, reader)
+                else:
+                    _, result, read_span = next(fresh_results)
+                record(read_span)
+                if cache is not None:
+                    cache.put(file, result)
+
+            if job is not None:
+                job.advance("read")
+            yield file, result
+    finally:
+        fresh_results.close()
+        # also keeps the files read before a cancellation
+        if cache is not None:
+            cache.save()
+
+
+def read_all_files(updater, from_date, to_date, base_dir, workers=1, cache=None, reader="openpyxl", index=None,
+                   job=None, tours: TourIndex | None = None):
+    # in date order like iter_schedule_chunks, the earliest copy of a duplicated tour is the one billed
+    files = sort_files_by_date(list_files(updater, from_date, to_date, base_dir, index), from_date, to_date)
     updater(f"Found {len(files)} files")
+    if tours is not None:
+        tours.release(files)
 
     dfs = []
     not_found = []
     typos = []
-    for file in files:
-        df, _not_found, _typos = read_file(file)
+    for file, (df, _not_found, _typos) in iter_file_results(updater, files, workers, cache, reader, job):
         not_found.extend(_not_found)
         typos.extend(_typos)
         if df is None:
@@ -163,12 +323,141 @@ def read_all_files(updater, from_date, to_date, base_dir):
         updater("No data found for any file")
         return None, not_found_df, typos_df
 
-    combined_df = concat(dfs, ignore_index=True).drop_duplicates(ignore_index=True)
+    with span("merge", "concat", rows=sum(len(df) for df in dfs)):
+        combined_df = concat(dfs, ignore_index=True).drop_duplicates(ignore_index=True)
+    with span("merge", "compact_schedule", rows=len(combined_df)):
+        combined_df = compact_schedule(combined_df)
     return combined_df, not_found_df, typos_df
 
 
+def sort_files_by_date(files, from_date, to_date):
+    # both the full and the abbreviated name of a month sort by its position in the date range
+    months = get_months(from_date, to_date)
+
+    def key(file):
+        directory, filename = file.split("/")[-2:]
+        return months[directory][0], parse_schedule_day(filename)
+
+    return sorted(files, key=key)
+
+
+def canonical_value(value):
+    # ints and floats compare equal in drop_duplicates but have different string forms
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)):
+        return float(value)
+    return value
+
+
+def hash_rows(df: DataFrame) -> np.ndarray:
+    """
+    Hash each row by its non null (column, value) pairs, so that rows which drop_duplicates would
+    consider equal after concatenating frames with different columns or dtypes hash equally too.
+    """
+    row_hashes = np.zeros(len(df), dtype=np.uint64)
+    for column in df.columns:
+        values = df[column]
+        column_hash = pd.util.hash_array(np.array([column], dtype=object))[0]
+        text = values.astype(object).map(canonical_value).astype(str).to_numpy(dtype=object)
+        value_hashes = pd.util.hash_array(text, categorize=False)
+        # multiplying by an odd constant after mixing in the column name keeps equal values in
+        # different columns from cancelling out in the sum
+        mixed = (value_hashes ^ column_hash) * np.uint64(0x9E3779B97F4A7C15)
+        mixed[values.isna().to_numpy()] = 0
+        row_hashes += mixed
+    return row_hashes
+
+
+class RowDeduplicator:
+    """ Drops rows already seen in earlier chunks, keeping only a 64 bit hash per distinct row """
+
+    def __init__(self):
+        self.seen = set()
+
+    def __call__(self, df: DataFrame) -> DataFrame:
+        keep = np.zeros(len(df), dtype=bool)
+        for idx, row_hash in enumerate(hash_rows(df).tolist()):
+            if row_hash not in self.seen:
+                self.seen.add(row_hash)
+                keep[idx] = True
+        return df[keep]
+
+
+def iter_schedule_chunks(updater, from_date, to_date, base_dir, chunk_files, workers=1, cache=None,
+                         reader="openpyxl", index=None, job=None, tours: TourIndex | None = None):
+    """
+    Streaming version of read_all_files which yields (df, not_found_df, typos_df) for every
+    chunk_files files, in date order and without rows or entries already yielded before.
+    """
+    files = sort_files_by_date(list_files(updater, from_date, to_date, base_dir, index), from_date, to_date)
+    updater(f"Found {len(files)} files")
+    # released up front like read_all_files, a tour of a later chunk must not stay owned by its old file
+    if tours is not None:
+        tours.release(files)
+
+    deduplicate = RowDeduplicator()
+    seen_not_found = set()
+    seen_typos = set()
+    n_rows = 0
+
+    dfs = []
+    not_found = []
+    typos = []
+    results = iter_file_results(updater, files, workers, cache, reader, job)
+    for idx, (file, (df, _not_found, _typos)) in enumerate(results):
+        not_found.extend(entry for entry in _not_found if entry not in seen_not_found)
+        seen_not_found.update(_not_found)
+        typos.extend(entry for entry in _typos if entry not in seen_typos)
+        seen_typos.update(_typos)
+        if df is None:
+            updater("No data found for " + file)
+        else:
+            dfs.append(df)
+
+        if (idx + 1) % chunk_files != 0 and idx + 1 != len(files):
+            continue
+
+        with span("merge", "deduplicate", rows=sum(len(df) for df in dfs)):
+            chunk_df = deduplicate(concat(dfs, ignore_index=True)) if dfs else DataFrame()
+        with span("merge", "compact_schedule", rows=len(chunk_df)):
+            chunk_df = compact_schedule(chunk_df)
+        n_rows += len(chunk_df)
+        yield (chunk_df,
+               DataFrame(not_found, columns=["File Name", "Restaurant"]),
+               DataFrame(typos, columns=["File Name", "Restaurant", "Sheet Name"]))
+        dfs, not_found, typos = [], [], []
+
+    if n_rows == 0:
+        updater("No data found for any file")
+
+
+def rates_file_path(base_dir):
+    return os.path.join(base_dir, "Rates.xlsx")
+
+
+def rates_sheet_date(sheet_name) -> date | None:
+    try:
+        return date.fromisoformat(str(sheet_name).strip())
+    except ValueError:
+        return None
+
+
 def read_rates_file(base_dir):
-    return pd.read_excel(os.path.join(base_dir, "Rates.xlsx"))
+    """
+    The first sheet of Rates.xlsx holds the rates which apply from the start. A sheet named with a
+    date, YYYY-MM-DD, is a complete rates table which replaces the sheet before it from that date on.
+    Other sheets are ignored.
+    """
+    sheets = pd.read_excel(rates_file_path(base_dir), sheet_name=None)
+    tables = []
+    for idx, (sheet_name, rates_df) in enumerate(sheets.items()):
+        effective_from = rates_sheet_date(sheet_name)
+        if effective_from is None and idx > 0:
+            continue
+        # the same unit for every sheet, so the sheet without a date concatenates without a dtype change
+        rates_df[EFFECTIVE_FROM] = pd.Series(pd.Timestamp(effective_from), index=rates_df.index,
+                                             dtype="datetime64[ns]")
+        tables.append(rates_df)
+    return concat(tables, ignore_index=True)
 
 
 def cell(ws, value, *,
@@ -186,13 +475,93 @@ def cell(ws, value, *,
 
 
 def ecell(ws):
-    return cell(ws, None, border=BORDER_BLACK, alignment=None, font=None)
+    return scell(ws, None, STYLE_EMPTY)
+
+
+def scell(ws, value, style):
+    _cell = WriteOnlyCell(ws, value)
+    _cell.style = style
+    return _cell
+
+
+def register_invoice_styles(workbook):
+    for name, style in INVOICE_STYLES.items():
+        workbook.add_named_style(NamedStyle(name=name, **style))
+
+
+def sort_invoice_rows(group: DataFrame) -> DataFrame:
+    return group.sort_values("Service Date Cleaned", kind="stable")
+
+
+def fingerprint_invoice(address, dmc, sorted_group: DataFrame) -> str:
+    # the price columns hold the rates applied to each row, so a rate change alters the fingerprint too
+    digest = hashlib.sha256()
+    digest.update(json.dumps([INVOICE_VERSION, address, str(dmc), INVOICE_COLUMNS]).encode())
+    row_hashes = pd.util.hash_pandas_object(sorted_group[INVOICE_COLUMNS], index=False)
+    digest.update(row_hashes.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_invoice_manifest(directory):
+    try:
+        with open(os.path.join(directory, INVOICE_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_invoice_manifest(directory, manifest):
+    with open(os.path.join(directory, INVOICE_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def invoice_manifest_entry(fingerprint, save_path):
+    stat = os.stat(save_path)
+    return {
+        "file": os.path.basename(save_path),
+        "fingerprint": fingerprint,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+
+def find_previous_run(restaurant_dir, current_run):
+    try:
+        runs = sorted(entry.name for entry in os.scandir(restaurant_dir)
+                      if entry.is_dir() and entry.name != current_run)
+    except OSError:
+        return None
+
+    # run directories are named by timestamp, so the last one with a manifest is the latest
+    for run in reversed(runs):
+        if os.path.exists(os.path.join(restaurant_dir, run, INVOICE_MANIFEST)):
+            return os.path.join(restaurant_dir, run)
+    return None
+
 
+def carry_over_invoice(previous_dir, entry, fingerprint, save_path) -> bool:
+    if entry is None or entry["fingerprint"] != fingerprint:
+        return False
 
-def write_invoice(updater, workbook, save_path, address, dmc, group: DataFrame):
-    sorted_group = group.sort_values("Service Date Cleaned")
+    previous_path = os.path.join(previous_dir, entry["file"])
+    try:
+        stat = os.stat(previous_path)
+    except OSError:
+        return False
 
+    # invoices are often filled in by hand (invoice number, date) after being generated, those
+    # edits must not leak into the new run so such files are regenerated instead of copied
+    if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime"]:
+        return False
+
+    # copy rather than hard link, a hard link would share later edits with the previous run
+    shutil.copy2(previous_path, save_path)
+    return True
+
+
+def write_invoice(updater, workbook, save_path, address, dmc, sorted_group: DataFrame):
     offset = 1
+    register_invoice_styles(workbook)
     ws = workbook.create_sheet()
 
     # column dimensions need to be written before any cell is written
@@ -205,10 +574,8 @@ def write_invoice(updater, workbook, save_path, address, dmc, group: DataFrame):
             width = 13
         ws.column_dimensions[get_column_letter(idx)].width = width
 
-    address_cell = cell(ws, address, font=FONT_BOLD, alignment=Alignment(wrapText=True, vertical="top"),
-                        border=BORDER_BLACK)
-    dmc_cell = cell(ws, dmc, font=FONT_BOLD, alignment=Alignment(horizontal="center", vertical="top"),
-                    border=BORDER_BLACK)
+    address_cell = cell(ws, address, font=FONT_BOLD, alignment=ALIGNMENT_WRAP_TOP, border=BORDER_BLACK)
+    dmc_cell = cell(ws, dmc, font=FONT_BOLD, alignment=ALIGNMENT_CENTER_TOP, border=BORDER_BLACK)
 
     ws.append([address_cell, None, None, None, dmc_cell, ecell(ws), ecell(ws), ecell(ws)])
     ws.append([ecell(ws), None, None, None, ecell(ws), ecell(ws), ecell(ws), ecell(ws)])
@@ -227,42 +594,23 @@ def write_invoice(updater, workbook, save_path, address, dmc, group: DataFrame):
     ws.append([])
     offset += 6
 
-    columns = ["Tour Code", "Service Date", "Service Type",
-               "Adult", "Children", "Price Adult", "Price Child"]
-
-    write_df = sorted_group[columns]
-    # itertuples cannot handle space in column name properly
-    write_df = write_df.rename(lambda x: x.replace(" ", "_"), axis="columns")
-
-    columns.append("Total")
-    column_cells = []
-    for column in columns:
-        column_cell = cell(ws, column, font=FONT_BOLD)
-        column_cells.append(column_cell)
-    ws.append(column_cells)
+    ws.append([scell(ws, column, STYLE_HEADER) for column in INVOICE_COLUMNS + ["Total"]])
     offset += 1
 
-    for idx, row in enumerate(write_df.itertuples(index=False)):
-        row_cells = []
-        for row_idx, value in enumerate(row):
-            if row_idx == 1:
-                row_cell = cell(ws, row.Service_Date)
-                row_cell.number_format = "dd mmm"
-            else:
-                row_cell = cell(ws, value, font=None)
-            row_cells.append(row_cell)
-
-        n_row = idx + offset
-        total_formula_cell = cell(ws, f"=D{n_row} * F{n_row} + E{n_row} * G{n_row}")
-        row_cells.append(total_formula_cell)
+    # prepare whole columns up front so that the row loop only wraps values in cells
+    columns = [sorted_group[column].tolist() for column in INVOICE_COLUMNS]
+    n_rows = len(sorted_group)
+    columns.append([f"=D{n_row} * F{n_row} + E{n_row} * G{n_row}" for n_row in range(offset, offset + n_rows)])
+    styles = [STYLE_DATE if column == "Service Date" else STYLE_CELL for column in INVOICE_COLUMNS + ["Total"]]
 
-        ws.append(row_cells)
+    for row in zip(*columns):
+        ws.append([scell(ws, value, style) for value, style in zip(row, styles)])
 
     ws.append([ecell(ws), ecell(ws), ecell(ws), ecell(ws),
                ecell(ws), ecell(ws), ecell(ws), ecell(ws)])
 
-    grand_total_label_cell = cell(ws, "Grand Total", font=FONT_BOLD)
-    grand_total_cell = cell(ws, f"=SUM(H{offset}:H{offset + write_df.shape[0]})", font=FONT_BOLD)
+    grand_total_label_cell = scell(ws, "Grand Total", STYLE_HEADER)
+    grand_total_cell = scell(ws, f"=SUM(H{offset}:H{offset + n_rows})", STYLE_HEADER)
     ws.append([ecell(ws), ecell(ws), ecell(ws), ecell(ws),
                ecell(ws), ecell(ws), grand_total_label_cell, grand_total_cell])
 
@@ -270,25 +618,231 @@ def write_invoice(updater, workbook, save_path, address, dmc, group: DataFrame):
     updater(f"Saved invoice to {save_path}")
 
 
-def write_all_invoices(updater, base_dir, address, df: DataFrame):
-    for name, group in df.groupby("Dmc Canonical"):
+def output_name(save_path):
+    # outputs are written to <restaurant>/<run>/, the restaurant tells same named files apart in a profile
+    restaurant_dir = os.path.dirname(os.path.dirname(save_path))
+    return f"{os.path.basename(restaurant_dir)}/{os.path.splitext(os.path.basename(save_path))[0]}"
+
+
+def write_invoice_file(save_path, address, dmc, sorted_group: DataFrame) -> tuple[list[str], bool, Span]:
+    """
+    Writes a single invoice into its own workbook and returns the progress messages instead of
+    sending them to an updater, so that it can run in another process.
+    """
+    messages = []
+    with measure("write_invoice", output_name(save_path), rows=len(sorted_group)) as write_span:
+        workbook = Workbook(write_only=True)
         try:
-            workbook = Workbook(write_only=True)
-            save_path = os.path.join(base_dir, str(name) + ".xlsx")
-            write_invoice(updater, workbook, save_path, address, name, group)
+            write_invoice(messages.append, workbook, save_path, address, dmc, sorted_group)
         except Exception:
             workbook.close()
-            updater("Unable to write invoice for {name}: {e}".format(name=name, e=traceback.format_exc()))
+            messages.append("Unable to write invoice for {name}: {e}".format(name=dmc, e=traceback.format_exc()))
+            return messages, False, write_span
+    return messages, True, write_span
+
+
+def write_all_invoices(updater, base_dir, address, df: DataFrame, previous_dir=None, executor=None, job=None):
+    previous_manifest = load_invoice_manifest(previous_dir) if previous_dir else {}
+    manifest = {}
+    n_carried_over = 0
+
+    # the manifest lists whatever was written when a job is cancelled half way, so that the next
+    # incremental run can still copy those invoices
+    try:
+        pending = []
+        for name, group in df.groupby("Dmc Canonical"):
+            if job is not None:
+                job.check()
+
+            sorted_group = sort_invoice_rows(group)
+            fingerprint = fingerprint_invoice(address, name, sorted_group)
+            save_path = os.path.join(base_dir, str(name) + ".xlsx")
 
+            if carry_over_invoice(previous_dir, previous_manifest.get(str(name)), fingerprint, save_path):
+                manifest[str(name)] = invoice_manifest_entry(fingerprint, save_path)
+                n_carried_over += 1
+                if job is not None:
+                    job.advance("write")
+                continue
 
-def write_auxiliary_df(updater, base_dir, name, df: DataFrame):
-    wb = Workbook()
-    ws = wb.active
-    for row in dataframe_to_rows(df, index=False, header=True):
-        ws.append(row)
-    for idx in range(1, len(df.columns.tolist()) + 1):
-        width = 30 if idx == 1 else 18
-        ws.column_dimensions[get_column_letter(idx)].width = width
+            # only the written columns are sent, which keeps pickling to the pool cheap
+            pending.append((name, fingerprint, save_path, sorted_group[INVOICE_COLUMNS]))
+
+        if n_carried_over:
+            updater(f"Copied {n_carried_over} unchanged invoices from {previous_dir}")
+
+        # every dmc is written to its own file, so the workbooks can be built and compressed in parallel
+        names, fingerprints, save_paths, groups = zip(*pending) if pending else ((), (), (), ())
+        addresses = [address] * len(pending)
+        if executor is None or len(pending) <= 1:
+            results = map(write_invoice_file, save_paths, addresses, names, groups)
+        else:
+            results = executor.map(write_invoice_file, save_paths, addresses, names, groups)
+
+        for name, fingerprint, save_path, (messages, written, write_span) in zip(names, fingerprints, save_paths,
+                                                                                   results):
+            record(write_span)
+            for message in messages:
+                updater(message)
+            if written:
+                manifest[str(name)] = invoice_manifest_entry(fingerprint, save_path)
+            if job is not None:
+                job.advance("write")
+                job.check()
+    finally:
+        save_invoice_manifest(base_dir, manifest)
+
+
+def write_invoice_summary(updater, base_dir, restaurant_name, summary_df: DataFrame):
+    """
+    Writes the totals of every invoice of the run as plain values, the invoices themselves only
+    hold formulas which have no value until Excel recalculates them.
+    """
+    save_path = os.path.join(base_dir, "Summary.xlsx")
+    with span("write_summary", output_name(save_path), rows=len(summary_df)):
+        workbook = Workbook(write_only=True)
+        ws = workbook.create_sheet("Summary")
+        ws.column_dimensions["B"].width = 20
+
+        ws.append([cell(ws, column, font=FONT_BOLD) for column in ["Restaurant", *summary_df.columns]])
+        for row in summary_df.itertuples(index=False):
+            ws.append([restaurant_name, *row])
+        ws.append([cell(ws, "Grand Total", font=FONT_BOLD), None, summary_df["Tours"].sum(),
+                   summary_df["Adults"].sum(), summary_df["Children"].sum(),
+                   cell(ws, summary_df["Total"].sum(), font=FONT_BOLD), summary_df["Rows Without Total"].sum(),
+                   summary_df["Aliased Tours"].sum()])
+        workbook.save(save_path)
+    updater(f"Saved invoice totals to {save_path}")
+
+
+def sheet_title(name, used: set[str]) -> str:
+    # excel refuses these characters and titles longer than 31 characters
+    title = "".join(" " if char in INVALID_TITLE_CHARACTERS else char for char in str(name))
+    title = title.strip()[:31] or "Sheet"
+    unique, idx = title, 2
+    while unique.lower() in used:
+        suffix = f" ({idx})"
+        unique, idx = title[:31 - len(suffix)] + suffix, idx + 1
+    used.add(unique.lower())
+    return unique
+
+
+def write_auxiliary_sheet(workbook, title, df: DataFrame):
+    ws = workbook.create_sheet(title)
+    n_columns = len(df.columns)
+    # column widths and the frozen header have to be set before the first row is written
+    for idx in range(1, n_columns + 1):
+        ws.column_dimensions[get_column_letter(idx)].width = 30 if idx == 1 else 18
+    ws.freeze_panes = "A2"
+    if n_columns:
+        ws.auto_filter.ref = f"A1:{get_column_letter(n_columns)}{len(df) + 1}"
+
+    ws.append([cell(ws, column, font=FONT_BOLD, alignment=None, border=None) for column in df.columns])
+    # rows are converted a batch of columns at a time, so only the batch exists as python values
+    for start in range(0, len(df), AUXILIARY_BATCH_ROWS):
+        batch = df.iloc[start:start + AUXILIARY_BATCH_ROWS]
+        for row in zip(*(batch[column].tolist() for column in batch.columns)):
+            ws.append(row)
+
+
+def write_auxiliary_df(updater, base_dir, name, df: DataFrame, sheet_column=None):
+    """
+    Writes df to base_dir/<name>.xlsx in write only mode, which streams the rows to disk instead of
+    building every cell first. With sheet_column, the rows of each of its values go to their own
+    sheet, without the columns that are empty for those rows.
+    """
     save_path = os.path.join(base_dir, f"{name}.xlsx")
-    wb.save(save_path)
+    with span("write_auxiliary", output_name(save_path), rows=len(df)):
+        workbook = Workbook(write_only=True)
+        used = set()
+        if sheet_column is None or sheet_column not in df.columns:
+            write_auxiliary_sheet(workbook, sheet_title(name, used), df)
+        else:
+            for value, group in df.groupby(sheet_column, sort=False, dropna=False, observed=True):
+                write_auxiliary_sheet(workbook, sheet_title(value, used), group.dropna(axis=1, how="all"))
+        workbook.save(save_path)
     updater(f"Saved {name} tours to {save_path}")
+
+
+def parquet_frame(df: DataFrame) -> DataFrame:
+    for column in df.columns:
+        if column in PARQUET_NUMERIC_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+        elif column == "Service Date Cleaned":
+            df[column] = pd.to_datetime(df[column])
+        else:
+            df[column] = df[column].astype("string")
+
+    if "Service Date Cleaned" in df.columns:
+        df["Month"] = df["Service Date Cleaned"].dt.strftime("%Y-%m").astype("string")
+    else:
+        df["Month"] = pd.Series(pd.NA, index=df.index, dtype="string")
+    return df
+
+
+def parquet_partitions(df: DataFrame) -> set[tuple[str, str]]:
+    if df.empty:
+        return set()
+    return set(zip(df["Restaurant"].astype(str), df["Month"].astype(object).fillna(PARQUET_NULL_PARTITION)))
+
+
+def read_parquet_partitions(kind_dir, partitioning, restaurants, months) -> DataFrame:
+    """ The rows of the Restaurant/Month partitions, months included, written by earlier runs """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(kind_dir):
+        return DataFrame()
+    dataset = ds.dataset(kind_dir, format="parquet", partitioning=partitioning)
+    # runs with different columns write files with different schemas, the first one would hide the others
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()]
+                              + [partitioning.schema])
+    dataset = ds.dataset(kind_dir, schema=schema, format="parquet", partitioning=partitioning)
+    month = ds.field("Month")
+    return dataset.to_table(filter=ds.field("Restaurant").isin(restaurants)
+                            & (month.isin(months) | month.is_null())).to_pandas()
+
+
+def write_parquet_dataset(updater, base_dir, results: dict[str, tuple[DataFrame, DataFrame, DataFrame]],
+                          from_date, to_date, file_names=()):
+    """
+    Writes the serviced, cancelled and invalid rows of every restaurant to hive partitioned
+    Parquet datasets under base_dir/Parquet/<kind>/Restaurant=<name>/Month=<yyyy-mm>, which
+    collect the whole season. A run replaces the rows serviced from from_date to to_date and, in
+    the partition of rows without a date, the rows of the schedules in file_names, the rows of the
+    other days and schedules written by earlier runs are kept.
+    """
+    # pyarrow is only needed for this export, keep it out of the import of io
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in PARQUET_PARTITIONS]),
+                                   flavor="hive")
+    months = list(pd.period_range(from_date, to_date, freq="M").strftime("%Y-%m"))
+    for idx, kind in enumerate(PARQUET_KINDS):
+        kind_dir = os.path.join(base_dir, PARQUET_DIRECTORY, kind)
+        # the restaurant partitions come from the results rather than from a column the rows may lack
+        frames = [frames[idx].assign(Restaurant=name) for name, frames in results.items() if not frames[idx].empty]
+        with span("read_parquet", kind):
+            previous_df = read_parquet_partitions(kind_dir, partitioning, list(results), months)
+        if not frames and previous_df.empty:
+            continue
+
+        if not previous_df.empty:
+            dates = previous_df.get("Service Date Cleaned", pd.Series(pd.NaT, index=previous_df.index))
+            file_names_read = previous_df.get("File Name", pd.Series(pd.NA, index=previous_df.index))
+            replaced = (dates.between(pd.Timestamp(from_date), pd.Timestamp(to_date))
+                        | (dates.isna() & file_names_read.isin(file_names)))
+            frames.insert(0, previous_df[~replaced].drop(columns="Month"))
+
+        # normalized after concatenating, columns missing from some restaurants come back as objects
+        df = parquet_frame(concat_parts(frames))
+        with span("write_parquet", kind, rows=len(df)):
+            if not df.empty:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                ds.write_dataset(table, kind_dir, format="parquet", partitioning=partitioning,
+                                 existing_data_behavior="delete_matching", basename_template="part-{i}.parquet")
+            # partitions whose rows were all replaced by none are not written over, they are removed
+            for restaurant, month in parquet_partitions(previous_df) - parquet_partitions(df):
+                shutil.rmtree(os.path.join(kind_dir, f"Restaurant={restaurant}", f"Month={month}"))
+        updater(f"Saved {len(df)} {kind} rows to {kind_dir}")
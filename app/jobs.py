@@ -0,0 +1,43 @@
+import threading
+
+
+class JobCancelled(Exception):
+    """ Raised from Job.check once the job has been cancelled """
+
+
+class Job:
+    """
+    Cancellation token and progress counters of a single run. The pipeline calls check() between
+    files and invoices and advance() after each of them, cancel() may be called from any thread.
+    """
+
+    def __init__(self, progress=None):
+        # progress(stage, done, total) is called on the thread running the job
+        self.progress = progress
+        self.counters = {}
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise JobCancelled()
+
+    def start(self, stage, total):
+        self.counters[stage] = [0, total]
+        self.report(stage)
+
+    def advance(self, stage, count=1):
+        counter = self.counters.setdefault(stage, [0, 0])
+        counter[0] += count
+        self.report(stage)
+
+    def report(self, stage):
+        if self.progress is not None:
+            done, total = self.counters[stage]
+            self.progress(stage, done, total)
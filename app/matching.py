@@ -0,0 +1,172 @@
+import json
+import os
+from collections import defaultdict
+
+import pandas
+from pandas import Series
+
+ALIAS_FILE = "Aliases.json"
+ALIAS_VERSION = 2
+# share of trigrams two names need in common to be matched, low enough for a missing or swapped
+# letter in a DMC name and high enough to keep apart names which only share a word
+MATCH_THRESHOLD = 0.6
+# the best match has to beat the runner up by this much, an ambiguous name stays unknown
+MATCH_MARGIN = 0.1
+
+
+def trigrams(name: str) -> set[str]:
+    # padded like pg_trgm so that the first and last letters count as much as the others
+    padded = f"  {' '.join(name.lower().split())} "
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from each trigram to the names containing it. A search only scores the names
+    sharing at least one trigram with the query instead of comparing it against every name.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for idx, name in enumerate(self.names):
+            grams = trigrams(str(name))
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(idx)
+
+    def scores(self, query: str) -> dict[int, float]:
+        grams = trigrams(query)
+        shared = defaultdict(int)
+        for gram in grams:
+            for idx in self.postings.get(gram, ()):
+                shared[idx] += 1
+        # jaccard similarity of the two trigram sets
+        return {idx: count / (len(grams) + self.sizes[idx] - count) for idx, count in shared.items()}
+
+    def match(self, query: str, threshold=MATCH_THRESHOLD, margin=MATCH_MARGIN):
+        """ The name most similar to query, None when nothing is similar enough or two names tie """
+        ranked = sorted(self.scores(query).items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < threshold:
+            return None
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < margin:
+            return None
+        return self.names[ranked[0][0]]
+
+
+class AliasTable:
+    """
+    Names from the schedules resolved to a DMC or service type of the rates file, stored as json
+    next to the rates. Matches found by similarity are only stored as suggestions, a suggestion is
+    accepted by moving it to the aliases, and only the aliases are applied. An alias can be
+    corrected by editing the file, setting it to null keeps that name unknown without suggestions.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.aliases = {}
+        self.suggestions = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                table = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if table.get("version") == ALIAS_VERSION:
+            self.aliases = table.get("aliases", {})
+            self.suggestions = table.get("suggestions", {})
+        elif table.get("version") == 1:
+            # the first version applied its matches without review, only the names kept unknown by
+            # hand stay aliases and the matches have to be accepted again
+            for kind, aliases in table.get("aliases", {}).items():
+                for name, alias in aliases.items():
+                    target = self.aliases if alias is None else self.suggestions
+                    target.setdefault(kind, {})[name] = alias
+            self.changed = True
+
+    def get(self, kind, name):
+        return self.aliases.get(kind, {}).get(name, "")
+
+    def suggest(self, kind, name, match):
+        if self.suggestions.get(kind, {}).get(name) != match:
+            self.suggestions.setdefault(kind, {})[name] = match
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"version": ALIAS_VERSION, "aliases": self.aliases, "suggestions": self.suggestions}, f,
+                      indent=2, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+        self.changed = False
+
+
+class NameResolver:
+    """
+    Resolves the DMCs and service types of the schedules which the rates do not know exactly. The
+    aliases of the alias table are applied, with suggest the other names are matched by trigram
+    similarity and every new match is reported through the updater and added as a suggestion.
+    """
+
+    def __init__(self, updater, aliases: AliasTable | None = None, suggest=True):
+        self.updater = updater
+        self.aliases = aliases
+        self.suggest = suggest
+        self.indexes = {}
+        # matches looked up this run, the chunks of a streamed run would search them again
+        self.matches = {}
+
+    def alias(self, kind, name, known: pandas.Index):
+        alias = self.aliases.get(kind, name) if self.aliases is not None else ""
+        # an alias to a name which is no longer in the rates is not applied
+        return alias if alias and alias in known else None
+
+    def resolve(self, kind, names: Series, known: pandas.Index) -> Series:
+        """ The names with their aliases applied """
+        resolved = names.copy()
+        for idx in (known.get_indexer(names) < 0).nonzero()[0]:
+            name = names.iloc[idx]
+            if isinstance(name, str) and name:
+                alias = self.alias(kind, name, known)
+                if alias is not None:
+                    resolved.iloc[idx] = alias
+        return resolved
+
+    def suggestions(self, kind, names: Series, known: pandas.Index) -> Series:
+        """ The most similar known name for each unknown name, None when there is none or suggest is off """
+        suggestions = Series(None, index=names.index, dtype=object)
+        if not self.suggest:
+            return suggestions
+        for idx in (known.get_indexer(names) < 0).nonzero()[0]:
+            name = names.iloc[idx]
+            if isinstance(name, str) and name:
+                suggestions.iloc[idx] = self.match(kind, name, known)
+        return suggestions
+
+    def match(self, kind, name, known: pandas.Index):
+        if (kind, name) in self.matches:
+            return self.matches[kind, name]
+
+        match = None
+        # a name aliased to null is kept unknown on purpose
+        if self.aliases is None or self.aliases.get(kind, name) is not None:
+            index = self.indexes.get(kind)
+            if index is None or index.names != list(known):
+                index = self.indexes[kind] = TrigramIndex(known)
+            match = index.match(name)
+        self.matches[kind, name] = match
+        if match is None:
+            return None
+
+        self.updater(f"Unknown {kind} \"{name}\" may be \"{match}\", "
+                     f"it is billed as such once accepted as an alias in {ALIAS_FILE}")
+        if self.aliases is not None:
+            self.aliases.suggest(kind, name, match)
+        return match
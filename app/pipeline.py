@@ -0,0 +1,168 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from .cache import DirectoryIndex, ScheduleCache, cache_directory, load_tour_index, save_tour_index
+from .core import ALIAS, RESTAURANTS, RatesIndex, Restaurant, TourIndex, process_all, process_chunks, \
+    process_rates_df, summarize_invoices
+from .io import INVOICE_COLUMNS, read_all_files, write_auxiliary_df, write_all_invoices, read_rates_file, \
+    find_previous_run, rates_file_path, iter_schedule_chunks, write_parquet_dataset, write_invoice_summary
+from .jobs import Job
+from .matching import ALIAS_FILE, AliasTable, NameResolver
+from .profiling import Profiler, span
+
+# the serviced rows kept between chunks when streaming, everything write_all_invoices and the summary need
+SERVICED_COLUMNS = INVOICE_COLUMNS + ["Service Date Cleaned", "Dmc Canonical", "Total", ALIAS]
+
+
+def load_rates(updater, input_directory, rates: RatesIndex | None = None) -> RatesIndex:
+    path = rates_file_path(input_directory)
+    source = (path, os.stat(path).st_mtime_ns)
+    if rates is not None and rates.source == source:
+        updater("Rates file unchanged, reusing rates from the previous run")
+        return rates
+
+    rates_df = read_rates_file(input_directory)
+    with span("rates", "process_rates_df", rows=len(rates_df)):
+        rates_df = process_rates_df(updater, rates_df)
+    return RatesIndex(rates_df, source=source)
+
+
+@dataclass
+class RunSummary:
+    rates: RatesIndex | None = None
+    rows: int = 0
+    timings: dict[str, float] = field(default_factory=dict)
+    restaurants: dict[str, dict[str, int | float]] = field(default_factory=dict)
+    profiler: Profiler = field(default_factory=Profiler)
+
+    def to_dict(self):
+        return {"rows": self.rows, "timings": self.timings, "restaurants": self.restaurants,
+                "profile": self.profiler.summary(), "peak_rss": self.profiler.peak_rss}
+
+
+def write_results(updater, summary: RunSummary, restaurants: list[Restaurant], results, output_directory,
+                  incremental=True, workers=1, split_invalid=False, job: Job | None = None):
+    suffix = datetime.now().strftime("%Y-%m-%d %H-%M-%S")
+    if job is not None:
+        job.start("write", sum(serviced_df["Dmc Canonical"].nunique()
+                               for serviced_df, _, _ in results.values() if not serviced_df.empty))
+
+    with ExitStack() as stack:
+        # a single pool shared by all restaurants, created only when there is something to fan out
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            # a cancelled job leaves invoices queued in the pool, those are dropped instead of written
+            stack.callback(executor.shutdown, cancel_futures=True)
+
+        for restaurant in restaurants:
+            if job is not None:
+                job.check()
+            serviced_df, cancelled_df, invalid_df = results[restaurant.name]
+            summary.restaurants[restaurant.name] = {
+                "serviced": len(serviced_df),
+                "cancelled": len(cancelled_df),
+                "invalid": len(invalid_df),
+                "invoices": 0 if serviced_df.empty else serviced_df["Dmc Canonical"].nunique(),
+                "total": 0.0 if serviced_df.empty else float(serviced_df["Total"].sum()),
+            }
+
+            restaurant_dir = os.path.join(output_directory, restaurant.name)
+            restaurant_base_path = os.path.join(restaurant_dir, suffix)
+            if not (cancelled_df.empty and serviced_df.empty and invalid_df.empty):
+                os.makedirs(restaurant_base_path, exist_ok=True)
+
+            if cancelled_df.empty:
+                updater(f"No cancelled tours for {restaurant.name}")
+            else:
+                write_auxiliary_df(updater, restaurant_base_path, "Cancelled", cancelled_df)
+
+            if invalid_df.empty:
+                updater(f"No invalid tour entries for {restaurant.name}")
+            else:
+                write_auxiliary_df(updater, restaurant_base_path, "Invalid", invalid_df,
+                                   sheet_column="Reason" if split_invalid else None)
+
+            if serviced_df.empty:
+                updater(f"No tours found for {restaurant.name}")
+            else:
+                write_invoice_summary(updater, restaurant_base_path, restaurant.name,
+                                      summarize_invoices(serviced_df))
+                previous_dir = find_previous_run(restaurant_dir, suffix) if incremental else None
+                write_all_invoices(updater, restaurant_base_path, restaurant.address, serviced_df, previous_dir,
+                                   executor=executor, job=job)
+
+
+def generate_invoices(updater, input_directory, from_date, to_date, workers=1, use_cache=True, incremental=True,
+                      rates: RatesIndex | None = None, output_directory=None,
+                      restaurants: list[Restaurant] = RESTAURANTS, reader="openpyxl",
+                      chunk_files: int | None = None, parquet=False, fuzzy=True, split_invalid=False,
+                      job: Job | None = None) -> RunSummary:
+    output_directory = output_directory or input_directory
+    summary = RunSummary()
+    # unlike the cache the aliases are kept with --no-cache, they are accepted by hand
+    aliases = AliasTable(os.path.join(input_directory, ALIAS_FILE))
+    resolver = NameResolver(updater, aliases, suggest=fuzzy)
+
+    # everything recorded with span() below, down to single files and invoices, ends up in summary.profiler
+    with summary.profiler.activate(), span("total") as total_span:
+        cache = index = None
+        # tours billed by earlier runs stay known, so a copy in a schedule of a later run is caught too
+        tours = TourIndex()
+        if use_cache:
+            cache_dir = cache_directory(input_directory)
+            cache = ScheduleCache(cache_dir)
+            index = DirectoryIndex(cache_dir)
+            tours = load_tour_index(cache_dir)
+
+        if chunk_files:
+            # rates are needed to filter each chunk as soon as it is read, reading and processing
+            # overlap so they are timed together
+            with span("load_rates") as rates_span:
+                rates = summary.rates = load_rates(updater, input_directory, rates)
+
+            def counted(chunks):
+                for chunk in chunks:
+                    summary.rows += len(chunk[0])
+                    yield chunk
+
+            with span("read_and_process") as read_span:
+                chunks = iter_schedule_chunks(updater, from_date, to_date, input_directory, chunk_files,
+                                              workers=workers, cache=cache, reader=reader, index=index,
+                                              job=job, tours=tours)
+                # the Parquet export keeps every column of the serviced rows, like without chunks
+                results = process_chunks(restaurants, from_date, to_date, rates, counted(chunks),
+                                         serviced_columns=None if parquet else SERVICED_COLUMNS,
+                                         resolver=resolver, tours=tours)
+                read_span.rows = summary.rows
+            process_span = read_span
+        else:
+            with span("read_all_files") as read_span:
+                df, not_found_df, typos_df = read_all_files(updater, from_date, to_date, input_directory,
+                                                            workers=workers, cache=cache, reader=reader, index=index,
+                                                            job=job, tours=tours)
+                summary.rows = read_span.rows = 0 if df is None else len(df)
+
+            with span("load_rates") as rates_span:
+                rates = summary.rates = load_rates(updater, input_directory, rates)
+
+            with span("process_all", rows=summary.rows) as process_span:
+                results = process_all(restaurants, from_date, to_date, rates, df, not_found_df, typos_df,
+                                      resolver, tours)
+        aliases.save()
+        if use_cache:
+            save_tour_index(cache_dir, tours)
+
+        with span("write_results") as write_span:
+            write_results(updater, summary, restaurants, results, output_directory, incremental, workers,
+                          split_invalid, job)
+            if parquet:
+                # tours.paths holds the schedules read this run, their rows replace those of earlier runs
+                write_parquet_dataset(updater, output_directory, results, from_date, to_date, set(tours.paths))
+
+    summary.timings = {"read": read_span.seconds, "rates": rates_span.seconds, "process": process_span.seconds,
+                       "write": write_span.seconds, "total": total_span.seconds}
+    return summary
@@ -0,0 +1,163 @@
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+SPAN_FIELDS = ["stage", "name", "seconds", "rows", "pid"]
+SUMMARY_COLUMNS = ["Stage", "Spans", "Seconds", "Rows", "Slowest"]
+
+ACTIVE_PROFILER: ContextVar["Profiler | None"] = ContextVar("active_profiler", default=None)
+
+
+def windows_peak_rss():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss() -> int | None:
+    """ High water mark of the resident memory of this process in bytes, None where unknown """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes everywhere except macos
+        return peak if sys.platform == "darwin" else peak * 1024
+    if sys.platform == "win32":
+        try:
+            return windows_peak_rss()
+        except (OSError, AttributeError):
+            return None
+    return None
+
+
+@dataclass
+class Span:
+    stage: str
+    name: str = ""
+    seconds: float = 0.0
+    rows: int | None = None
+    # the process the span was measured in, a pool worker when reading in parallel
+    pid: int = field(default_factory=os.getpid)
+
+
+@contextmanager
+def measure(stage, name="", rows=None):
+    """ Times the block into the yielded span without recording it, for spans sent back from workers """
+    measured = Span(stage, str(name), rows=rows)
+    start = time.perf_counter()
+    try:
+        yield measured
+    finally:
+        measured.seconds = time.perf_counter() - start
+
+
+def record(measured: Span):
+    profiler = ACTIVE_PROFILER.get()
+    if profiler is not None:
+        profiler.spans.append(measured)
+
+
+@contextmanager
+def span(stage, name="", rows=None):
+    """ Like measure, but records the span with the active profiler, also when the block raises """
+    measured = None
+    try:
+        with measure(stage, name, rows) as measured:
+            yield measured
+    finally:
+        if measured is not None:
+            record(measured)
+
+
+class Profiler:
+    """
+    Collects the spans recorded while it is active. Activation is tracked per thread (and per
+    asyncio task), so a run in a worker thread does not pick up spans from the GUI thread.
+
+    The peak resident memory is taken once when the profiler is deactivated. The operating system
+    only keeps the high water mark of the whole process, which a single stage cannot be told apart
+    in and which also covers earlier runs of the same process, like in the GUI.
+    """
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self.peak_rss: int | None = None
+
+    @contextmanager
+    def activate(self):
+        token = ACTIVE_PROFILER.set(self)
+        try:
+            yield self
+        finally:
+            ACTIVE_PROFILER.reset(token)
+            self.peak_rss = peak_rss()
+
+    def summary(self) -> list[dict]:
+        stages = {}
+        for measured in self.spans:
+            stage = stages.setdefault(measured.stage, {
+                "stage": measured.stage, "spans": 0, "seconds": 0.0, "rows": None,
+                "slowest": None, "slowest_seconds": 0.0,
+            })
+            stage["spans"] += 1
+            stage["seconds"] += measured.seconds
+            if measured.rows is not None:
+                stage["rows"] = (stage["rows"] or 0) + measured.rows
+            if measured.name and measured.seconds >= stage["slowest_seconds"]:
+                stage["slowest"] = measured.name
+                stage["slowest_seconds"] = measured.seconds
+        return list(stages.values())
+
+    def summary_rows(self) -> list[list[str]]:
+        rows = []
+        for stage in self.summary():
+            slowest = f"{stage['slowest']} ({stage['slowest_seconds']:.3f}s)" if stage["slowest"] else ""
+            rows.append([stage["stage"], str(stage["spans"]), f"{stage['seconds']:.3f}",
+                         "" if stage["rows"] is None else str(stage["rows"]), slowest])
+        return rows
+
+    def format_peak_rss(self) -> str:
+        if self.peak_rss is None:
+            return ""
+        return f"Peak resident memory of the process: {self.peak_rss / (1024 * 1024):.0f} MB"
+
+    def format_summary(self) -> str:
+        rows = [SUMMARY_COLUMNS] + self.summary_rows()
+        widths = [max(len(row[idx]) for row in rows) for idx in range(len(SUMMARY_COLUMNS))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        if self.peak_rss is not None:
+            lines.append(self.format_peak_rss())
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """ Writes every span to path, as csv when it ends with .csv and as json otherwise """
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=SPAN_FIELDS)
+                writer.writeheader()
+                writer.writerows(asdict(measured) for measured in self.spans)
+        else:
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(), "peak_rss": self.peak_rss,
+                           "spans": [asdict(measured) for measured in self.spans]}, f, indent=2)
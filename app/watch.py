@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+import traceback
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from .cache import ScheduleCache, cache_directory
+from .io import list_files, read_file
+
+WATCH_INTERVAL = 30
+# schedules of the previous month still change at its end, the next month's are prepared ahead
+WATCH_MONTHS_BACK = 1
+WATCH_MONTHS_AHEAD = 1
+# a file modified this recently may still be being copied or saved, it is read on a later poll
+WATCH_SETTLE_NS = 5 * 10 ** 9
+
+
+def watch_window(today: date | None = None) -> tuple[date, date]:
+    today = today or date.today()
+    return (today + relativedelta(months=-WATCH_MONTHS_BACK, day=1),
+            today + relativedelta(months=WATCH_MONTHS_AHEAD, day=31))
+
+
+class ScheduleWatcher:
+    """
+    Polls the month folders around today and reads every new or changed schedule into the schedule
+    cache, so that generating invoices afterwards only loads the parsed results. The window moves
+    with the date, a watcher can keep running from one month to the next.
+    """
+
+    def __init__(self, updater, base_dir, reader="openpyxl", stop: threading.Event | None = None):
+        self.updater = updater
+        self.base_dir = base_dir
+        self.reader = reader
+        self.stop = stop or threading.Event()
+        # mtime of the files which could not be read, they are only tried again once they change
+        self.failed = {}
+
+    def poll(self) -> int:
+        """ Reads the schedules which are not cached yet and returns how many were read """
+        from_date, to_date = watch_window()
+        files = list_files(lambda message: None, from_date, to_date, self.base_dir)
+        cache = ScheduleCache(cache_directory(self.base_dir))
+        n_read = 0
+        try:
+            for file in files:
+                if self.stop.is_set():
+                    break
+                try:
+                    mtime = os.stat(file).st_mtime_ns
+                except OSError:
+                    continue
+                if time.time_ns() - mtime < WATCH_SETTLE_NS or self.failed.get(file) == mtime:
+                    continue
+
+                try:
+                    if cache.fresh(file):
+                        continue
+                    result = read_file(file, self.reader)
+                except Exception:
+                    # generating invoices reads the file again and reports the error itself
+                    self.failed[file] = mtime
+                    self.updater(f"Unable to read {file} in the background: {traceback.format_exc(limit=0).strip()}")
+                    continue
+                cache.put(file, result)
+                n_read += 1
+                self.updater(f"Read {file} in the background")
+        finally:
+            if n_read:
+                cache.save()
+        return n_read
+
+    def run(self, interval=WATCH_INTERVAL):
+        """ Polls every interval seconds until stop is set """
+        while not self.stop.is_set():
+            self.poll()
+            self.stop.wait(interval)
@@ -0,0 +1,230 @@
+import posixpath
+import zipfile
+from warnings import warn
+from xml.etree.ElementTree import fromstring, iterparse
+
+from openpyxl.cell.text import Text
+from openpyxl.reader.strings import read_string_table
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, WINDOWS_EPOCH, from_excel, from_ISO8601
+from openpyxl.xml.constants import SHEET_MAIN_NS, REL_NS, PKG_REL_NS
+
+ROW_TAG = "{%s}row" % SHEET_MAIN_NS
+VALUE_TAG = "{%s}v" % SHEET_MAIN_NS
+FORMULA_TAG = "{%s}f" % SHEET_MAIN_NS
+INLINE_STRING_TAG = "{%s}is" % SHEET_MAIN_NS
+TEXT_TAG = "{%s}t" % SHEET_MAIN_NS
+RELATIONSHIP_TAG = "{%s}Relationship" % PKG_REL_NS
+
+OFFICE_DOCUMENT_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+WORKSHEET_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"
+SHARED_STRINGS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+STYLES_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+
+
+class UnsupportedWorkbook(Exception):
+    """ Raised for content the fast reader does not handle, the caller should use openpyxl instead """
+
+
+def read_relationships(archive, path):
+    folder, name = posixpath.split(path)
+    rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+    try:
+        root = fromstring(archive.read(rels_path))
+    except KeyError:
+        return {}
+
+    relationships = {}
+    for rel in root.iter(RELATIONSHIP_TAG):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        # same resolution as openpyxl.packaging.relationship.get_dependents
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        relationships[rel.get("Id")] = (rel.get("Type"), target)
+    return relationships
+
+
+def cast_number(value):
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def inline_text(element):
+    children = list(element)
+    if len(children) == 1 and children[0].tag == TEXT_TAG:
+        return children[0].text or ""
+    return Text.from_tree(element).content
+
+
+class FastWorksheet:
+
+    def __init__(self, workbook, path):
+        self.workbook = workbook
+        self.path = path
+
+    def iter_rows(self, max_col, max_row, values_only=True):
+        """
+        Yields the same rows as openpyxl's read only iter_rows(values_only=True) except for missing
+        rows, which are skipped instead of being filled with None.
+        """
+        if not values_only:
+            raise UnsupportedWorkbook("only values can be read")
+
+        workbook = self.workbook
+        row_counter = 0
+        next_row = 1
+        with workbook.archive.open(self.path) as source:
+            for _, element in iterparse(source):
+                if element.tag != ROW_TAG:
+                    continue
+
+                r = element.get("r")
+                row_counter = int(float(r)) if r else row_counter + 1
+                if row_counter > max_row:
+                    break
+
+                values = [None] * max_col
+                col_counter = 0
+                for cell in element:
+                    coordinate = cell.get("r")
+                    if coordinate:
+                        col_counter = coordinate_to_tuple(coordinate)[1]
+                    else:
+                        col_counter += 1
+                    if col_counter <= max_col:
+                        values[col_counter - 1] = workbook.cell_value(cell, coordinate)
+                element.clear()
+
+                # like openpyxl, rows listed out of order are ignored
+                if row_counter >= next_row:
+                    next_row = row_counter + 1
+                    yield tuple(values)
+
+
+class FastWorkbook:
+    """
+    Reads cell values straight from the xlsx archive without building openpyxl's workbook,
+    style and cell objects. Only the parts of the format used by the schedules are handled,
+    anything else raises UnsupportedWorkbook.
+    """
+
+    def __init__(self, file):
+        self.archive = zipfile.ZipFile(file)
+        try:
+            self.load()
+        except Exception:
+            self.archive.close()
+            raise
+
+    def load(self):
+        root_rels = read_relationships(self.archive, "")
+        workbook_paths = [target for rel_type, target in root_rels.values() if rel_type == OFFICE_DOCUMENT_REL]
+        if not workbook_paths:
+            raise UnsupportedWorkbook("workbook part not found")
+
+        workbook_path = workbook_paths[0]
+        root = fromstring(self.archive.read(workbook_path))
+        if root.tag != "{%s}workbook" % SHEET_MAIN_NS:
+            raise UnsupportedWorkbook(f"unsupported workbook namespace {root.tag}")
+
+        properties = root.find("{%s}workbookPr" % SHEET_MAIN_NS)
+        date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+        self.epoch = CALENDAR_MAC_1904 if date1904 else WINDOWS_EPOCH
+
+        relationships = read_relationships(self.archive, workbook_path)
+        self.sheets = {}
+        for sheet in root.iter("{%s}sheet" % SHEET_MAIN_NS):
+            rel_type, target = relationships.get(sheet.get("{%s}id" % REL_NS), (None, None))
+            # chartsheets and missing parts are listed by openpyxl but have no rows to read
+            self.sheets[sheet.get("name")] = target if rel_type == WORKSHEET_REL else None
+
+        self.shared_strings = []
+        self.date_formats = set()
+        self.timedelta_formats = set()
+        for rel_type, target in relationships.values():
+            if rel_type == SHARED_STRINGS_REL:
+                with self.archive.open(target) as source:
+                    self.shared_strings = read_string_table(source)
+            elif rel_type == STYLES_REL:
+                self.load_number_formats(target)
+
+    def load_number_formats(self, path):
+        # mirrors openpyxl.styles.stylesheet.Stylesheet._normalise_numbers
+        root = fromstring(self.archive.read(path))
+        custom_formats = {
+            int(fmt.get("numFmtId")): fmt.get("formatCode")
+            for fmt in root.iter("{%s}numFmt" % SHEET_MAIN_NS)
+        }
+        cell_xfs = root.find("{%s}cellXfs" % SHEET_MAIN_NS)
+        if cell_xfs is None:
+            return
+
+        for idx, xf in enumerate(cell_xfs.iter("{%s}xf" % SHEET_MAIN_NS)):
+            num_fmt_id = int(xf.get("numFmtId", 0))
+            if num_fmt_id in custom_formats:
+                fmt = custom_formats[num_fmt_id]
+            else:
+                fmt = builtin_format_code(num_fmt_id)
+            if is_date_format(fmt):
+                self.date_formats.add(idx)
+            if is_timedelta_format(fmt):
+                self.timedelta_formats.add(idx)
+
+    @property
+    def sheetnames(self):
+        return list(self.sheets)
+
+    def __contains__(self, name):
+        return name in self.sheets
+
+    def __getitem__(self, name):
+        path = self.sheets[name]
+        if path is None:
+            raise UnsupportedWorkbook(f"{name} is not a worksheet")
+        return FastWorksheet(self, path)
+
+    def close(self):
+        self.archive.close()
+
+    def cell_value(self, cell, coordinate):
+        # mirrors openpyxl.worksheet._reader.WorkSheetParser.parse_cell for read only, non data only workbooks
+        data_type = cell.get("t", "n")
+
+        formula = cell.find(FORMULA_TAG)
+        if formula is not None:
+            if formula.get("t") is not None:
+                raise UnsupportedWorkbook(f"{formula.get('t')} formula in {coordinate}")
+            return "=" + (formula.text or "")
+
+        if data_type == "inlineStr":
+            child = cell.find(INLINE_STRING_TAG)
+            return inline_text(child) if child is not None else None
+
+        value = cell.findtext(VALUE_TAG, None) or None
+        if value is None:
+            return None
+
+        if data_type == "n":
+            value = cast_number(value)
+            style_id = int(cell.get("s", 0))
+            if style_id in self.date_formats:
+                try:
+                    return from_excel(value, self.epoch, timedelta=style_id in self.timedelta_formats)
+                except (OverflowError, ValueError):
+                    warn(f"Cell {coordinate} is marked as a date but the serial value {value} is outside the "
+                         f"limits for dates. The cell will be treated as an error.")
+                    return "#VALUE!"
+            return value
+        if data_type == "s":
+            return self.shared_strings[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        return value
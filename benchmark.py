@@ -0,0 +1,246 @@
+"""
+Times each stage of invoice generation on synthetic schedules written by create.py and prints
+the results as JSON. The data only depends on the options, so runs made with the same options
+on different commits can be compared stage by stage.
+
+    python benchmark.py --days 60 --rows-per-sheet 40 --output after.json
+    python benchmark.py --days 60 --rows-per-sheet 40 --source ../baseline --output before.json
+
+The schedules are always generated by the create.py next to this script, --source only changes
+the checkout whose stages are timed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import date
+
+import openpyxl
+import pandas
+from pandas import concat
+
+from create import ScheduleConfig, write_schedules
+
+# main.py of older checkouts sets this before importing app, app.core sets it itself since, set here
+# so that every checkout is timed in the mode the application runs it in
+pandas.set_option("mode.copy_on_write", True)
+
+READERS = ["openpyxl", "fast"]
+
+
+def parse_weights(text):
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def parse_args(argv=None):
+    defaults = ScheduleConfig()
+    parser = argparse.ArgumentParser(description="Benchmark invoice generation on synthetic schedules.")
+    parser.add_argument("--start", type=date.fromisoformat, default=defaults.start,
+                        help="first schedule date, YYYY-MM-DD (default: %(default)s)")
+    parser.add_argument("--days", type=int, default=defaults.days, help="number of daily schedules (default: %(default)s)")
+    parser.add_argument("--rows-per-sheet", type=int, default=defaults.rows_per_sheet,
+                        help="tours per restaurant sheet, rows past the reader's MAX_ROWS are not read "
+                             "(default: %(default)s)")
+    parser.add_argument("--dmcs", type=parse_weights, help="DMC mix as name=weight,... (default: built in mix)")
+    parser.add_argument("--service-types", type=parse_weights,
+                        help="service type mix as name=weight,... (default: built in mix)")
+    parser.add_argument("--date-noise", type=float, default=defaults.date_noise,
+                        help="fraction of service dates written as text (default: %(default)s)")
+    parser.add_argument("--cancellation-rate", type=float, default=defaults.cancellation_rate,
+                        help="fraction of cancelled tours (default: %(default)s)")
+    parser.add_argument("--price-rate", type=float, default=defaults.price_rate,
+                        help="fraction of tours with their own price instead of the rates (default: %(default)s)")
+    parser.add_argument("--typo-rate", type=float, default=defaults.typo_rate,
+                        help="fraction of misnamed restaurant sheets (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="random seed (default: %(default)s)")
+    parser.add_argument("--reader", choices=READERS, default="openpyxl", help="schedule reader (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per stage, the fastest one is reported (default: %(default)s)")
+    parser.add_argument("--source", metavar="DIRECTORY",
+                        help="checkout of the invoice generator to time (default: the one next to this script)")
+    parser.add_argument("--data-directory", help="keep the generated schedules here instead of a temporary directory")
+    parser.add_argument("-o", "--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    config = ScheduleConfig(start=args.start, days=args.days, rows_per_sheet=args.rows_per_sheet,
+                            date_noise=args.date_noise, cancellation_rate=args.cancellation_rate,
+                            price_rate=args.price_rate, typo_rate=args.typo_rate, seed=args.seed)
+    if args.dmcs:
+        config.dmcs = args.dmcs
+    if args.service_types:
+        config.service_types = args.service_types
+    return args, config
+
+
+class Checkout:
+    """
+    The stage functions of the checkout being timed. Checkouts from before the rates index, the
+    single pass over all restaurants or the choice of reader only have the per restaurant process
+    and read_file of the original code, the stages missing from them are left out of the results.
+    """
+
+    def __init__(self, source=None):
+        # imported from the checkout instead of the directory of this script, create is already imported
+        if source is not None:
+            sys.path.insert(0, os.path.abspath(source))
+        from app import core, io
+        self.core = core
+        self.io = io
+        self.readers = getattr(io, "READERS", ["openpyxl"])
+        self.compact_schedule = getattr(core, "compact_schedule", None)
+
+    def read_file(self, file, reader):
+        return self.io.read_file(file, reader) if hasattr(self.io, "READERS") else self.io.read_file(file)
+
+    def rates(self, rates_df):
+        return self.core.RatesIndex(rates_df) if hasattr(self.core, "RatesIndex") else rates_df
+
+    def process(self, from_date, to_date, rates, df, not_found_df, typos_df):
+        restaurants = self.core.RESTAURANTS
+        if hasattr(self.core, "process_all"):
+            return self.core.process_all(restaurants, from_date, to_date, rates, df, not_found_df, typos_df)
+        return {restaurant.name: self.core.process(restaurant, from_date, to_date, rates, df, not_found_df, typos_df)
+                for restaurant in restaurants}
+
+
+def git_revision(root):
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision, dirty
+
+
+def run_stages(checkout: Checkout, data_directory, output_directory, config, reader, record):
+    """ Runs every stage once, record(stage, func, unit, count) runs func and returns its result """
+    updater = lambda x: None
+    from_date, to_date = config.start, config.dates()[-1]
+    core, io = checkout.core, checkout.io
+
+    files = record("list_files", lambda: io.list_files(updater, from_date, to_date, data_directory),
+                   "files", len)
+
+    results = record("read_file", lambda: [checkout.read_file(file, reader) for file in files], "files", len)
+    dfs = [df for df, _, _ in results if df is not None]
+    df = concat(dfs, ignore_index=True).drop_duplicates(ignore_index=True)
+    if checkout.compact_schedule is not None:
+        df = record("compact_schedule", lambda: checkout.compact_schedule(df), "rows", len)
+    not_found_df = pandas.DataFrame([e for _, nf, _ in results for e in nf], columns=["File Name", "Restaurant"])
+    typos_df = pandas.DataFrame([e for _, _, t in results for e in t], columns=["File Name", "Restaurant", "Sheet Name"])
+
+    rates_df = io.read_rates_file(data_directory)
+    rates_df = record("process_rates_df", lambda: core.process_rates_df(updater, rates_df), "rates", len)
+    rates = checkout.rates(rates_df)
+
+    processed = record("process", lambda: checkout.process(from_date, to_date, rates, df, not_found_df, typos_df),
+                       "rows", lambda _: len(df))
+
+    def write_invoices():
+        for restaurant in core.RESTAURANTS:
+            serviced_df = processed[restaurant.name][0]
+            if not serviced_df.empty:
+                base_dir = os.path.join(output_directory, restaurant.name)
+                os.makedirs(base_dir, exist_ok=True)
+                io.write_all_invoices(updater, base_dir, restaurant.address, serviced_df)
+
+    n_invoices = sum(serviced_df["Dmc Canonical"].nunique()
+                     for serviced_df, _, _ in processed.values() if not serviced_df.empty)
+    record("write_all_invoices", write_invoices, "invoices", lambda _: n_invoices)
+
+    def write_auxiliary():
+        for restaurant in core.RESTAURANTS:
+            _, cancelled_df, invalid_df = processed[restaurant.name]
+            base_dir = os.path.join(output_directory, restaurant.name)
+            os.makedirs(base_dir, exist_ok=True)
+            if not cancelled_df.empty:
+                io.write_auxiliary_df(updater, base_dir, "Cancelled", cancelled_df)
+            if not invalid_df.empty:
+                io.write_auxiliary_df(updater, base_dir, "Invalid", invalid_df)
+
+    n_auxiliary_rows = sum(len(cancelled_df) + len(invalid_df) for _, cancelled_df, invalid_df in processed.values())
+    record("write_auxiliary_df", write_auxiliary, "rows", lambda _: n_auxiliary_rows)
+
+
+def benchmark(checkout: Checkout, data_directory, config, reader, repeat):
+    stages = {}
+
+    def timed(stage, func, unit, count):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        entry = stages.setdefault(stage, {"unit": unit, "count": count(result), "runs": []})
+        entry["runs"].append(elapsed)
+        return result
+
+    def traced(stage, func, unit, count):
+        # a separate pass, tracemalloc slows allocations down too much to time the same run
+        tracemalloc.start()
+        try:
+            result = func()
+            stages[stage]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return result
+
+    for record in [timed] * repeat + [traced]:
+        with tempfile.TemporaryDirectory() as output_directory:
+            run_stages(checkout, data_directory, output_directory, config, reader, record)
+
+    for entry in stages.values():
+        entry["seconds"] = min(entry["runs"])
+        entry["per_second"] = entry["count"] / entry["seconds"] if entry["seconds"] else None
+    return stages
+
+
+def main(argv=None):
+    args, config = parse_args(argv)
+    root = args.source or os.path.dirname(os.path.abspath(__file__))
+    revision, dirty = git_revision(root)
+    checkout = Checkout(args.source)
+    if args.reader not in checkout.readers:
+        sys.exit(f"The {args.reader} reader is not available in {root}")
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        data_directory = args.data_directory or temporary_directory
+        start = time.perf_counter()
+        write_schedules(data_directory, config)
+        print(f"Generated {config.days} schedules in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        stages = benchmark(checkout, data_directory, config, args.reader, max(1, args.repeat))
+
+    result = {
+        "revision": revision,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "pandas": pandas.__version__,
+        "copy_on_write": pandas.get_option("mode.copy_on_write"),
+        "openpyxl": openpyxl.__version__,
+        "platform": platform.platform(),
+        "reader": args.reader,
+        "repeat": args.repeat,
+        "config": asdict(config),
+        "stages": stages,
+    }
+    output = json.dumps(result, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
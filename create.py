@@ -1,4 +1,7 @@
 import calendar
+import random
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from typing import Optional
 
@@ -40,6 +43,35 @@ restaurants = [
     ("WaytoIndia", "Way to India"),
     ("Tara", "Tara")
 ]
+# formats the schedules have been seen with, the last one is only understood by the dateutil fallback
+DATE_NOISE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m-%d-%Y", "%d %B %Y"]
+
+
+@dataclass
+class ScheduleConfig:
+    """ What write_schedules generates, the same config and seed always give the same files """
+    start: date = date(2025, 6, 1)
+    days: int = 30
+    rows_per_sheet: int = 20
+    # relative weights, unrated DMCs are left out of the rates file and end up as invalid rows
+    dmcs: dict[str, float] = field(default_factory=lambda: {
+        "Thomas Cook": 4, "SOTC": 3, "Cox & Kings": 2, "Kesari": 2, "Veena World": 1, "Unknown Travels": 0.2,
+    })
+    unrated_dmcs: tuple[str, ...] = ("Unknown Travels",)
+    service_types: dict[str, float] = field(default_factory=lambda: {
+        "Lunch": 5, "Dinner": 4, "Breakfast": 1, "Packed Lunch": 1,
+    })
+    # fraction of service dates written as text instead of a date cell, a tenth of those are unreadable
+    date_noise: float = 0.2
+    cancellation_rate: float = 0.1
+    # fraction of tours with a price agreed for them, which is billed instead of the rates
+    price_rate: float = 0.05
+    # fraction of sheets named in upper case, which the reader reports as a typo
+    typo_rate: float = 0.05
+    seed: int = 0
+
+    def dates(self):
+        return [self.start + timedelta(days=idx) for idx in range(self.days)]
 
 
 def cell(ws, value, *,
@@ -56,8 +88,8 @@ def cell(ws, value, *,
     return _cell
 
 
-def write_sheet(workbook, filename, restaurant):
-    worksheet = workbook.create_sheet(title=restaurant[0])
+def write_sheet(workbook, filename, restaurant, rows=(), title=None):
+    worksheet = workbook.create_sheet(title=title or restaurant[0])
 
     worksheet.row_dimensions[1].height = 30
     worksheet.row_dimensions[3].height = 25
@@ -84,24 +116,96 @@ def write_sheet(workbook, filename, restaurant):
     ]
     worksheet.append(header)
 
+    for row in rows:
+        worksheet.append(row)
 
-def write_file(month_name, day):
+
+def write_file(month_name, day, base_path=BASE_PATH):
     filename = f"{day}-{month_name}"
     workbook = Workbook(write_only=True)
     for restaurant in restaurants:
         write_sheet(workbook, filename, restaurant)
-    workbook.save(BASE_PATH / month_name / f"{filename}.xlsx")
+    workbook.save(base_path / month_name / f"{filename}.xlsx")
 
 
-def write_all_files():
+def write_all_files(base_path=BASE_PATH):
     for month in range(1, 13):
         month_name = calendar.month_name[month]
-        month_path = BASE_PATH / month_name
+        month_path = base_path / month_name
         month_path.mkdir(parents=True, exist_ok=True)
 
         _, last_day = calendar.monthrange(2025, month)
         for day in range(1, last_day + 1):
-            write_file(month_name, day)
+            write_file(month_name, day, base_path)
+
+
+def pick(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def service_date(rng, config, day):
+    if rng.random() >= config.date_noise:
+        return datetime(day.year, day.month, day.day)
+    if rng.random() < 0.1:
+        return "TBC"
+    return day.strftime(rng.choice(DATE_NOISE_FORMATS))
+
+
+def generate_row(rng, config, day):
+    dmc = pick(rng, config.dmcs)
+    # the same DMC is typed in different ways, the rates lookup has to normalize them
+    dmc = rng.choice([dmc, dmc, dmc.lower(), f" {dmc}  "])
+    adults = rng.randint(1, 45)
+    children = rng.choice([None, 0, rng.randint(1, 6)])
+    delivery = "Cancelled" if rng.random() < config.cancellation_rate else rng.choice([None, "Delivered"])
+    price_adult = price_child = None
+    if rng.random() < config.price_rate:
+        # a blank child price is billed at the child rate
+        price_adult, price_child = rng.randint(15, 35), rng.choice([None, rng.randint(5, 15)])
+    return [
+        f"TC{rng.randint(1000, 9999)}", rng.choice(["Amit", "Priya", "Rahul", "Sneha"]),
+        service_date(rng, config, day), pick(rng, config.service_types), adults, children,
+        rng.choice(["12:00", "12:30", "19:30", "20:00"]), dmc, adults + (children or 0), None, None, None,
+        delivery, None, price_adult, price_child,
+    ]
+
+
+def write_schedule_file(base_path, config, rng, day):
+    month_name = calendar.month_name[day.month]
+    filename = f"{day.day}-{month_name}"
+    workbook = Workbook(write_only=True)
+    for restaurant in restaurants:
+        title = restaurant[0].upper() if rng.random() < config.typo_rate else restaurant[0]
+        rows = [generate_row(rng, config, day) for _ in range(config.rows_per_sheet)]
+        write_sheet(workbook, filename, restaurant, rows, title=title)
+
+    month_path = Path(base_path) / month_name
+    month_path.mkdir(parents=True, exist_ok=True)
+    workbook.save(month_path / f"{filename}.xlsx")
+
+
+def write_rates_file(base_path, config):
+    rng = random.Random(config.seed)
+    service_types = list(config.service_types)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Rates")
+    worksheet.append(["DMC", *service_types, "Child"])
+    worksheet.append(["Default", *(rng.randint(15, 30) for _ in service_types), 10])
+    for dmc in config.dmcs:
+        if dmc in config.unrated_dmcs:
+            continue
+        # blank rates fall back to the default row
+        worksheet.append([dmc, *(rng.choice([None, rng.randint(15, 30)]) for _ in service_types), None])
+    workbook.save(Path(base_path) / "Rates.xlsx")
+
+
+def write_schedules(base_path, config: ScheduleConfig):
+    """ Writes filled in schedules for every day of the config and a matching Rates.xlsx """
+    rng = random.Random(config.seed)
+    Path(base_path).mkdir(parents=True, exist_ok=True)
+    write_rates_file(base_path, config)
+    for day in config.dates():
+        write_schedule_file(base_path, config, rng, day)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,20 @@
 import sys
+import time
 
-import pandas as pd
-from PyQt5.QtWidgets import QApplication
+STARTED_AT = time.perf_counter()
 
-from app.gui import InvoiceGeneratorApp
+from multiprocessing import freeze_support  # noqa: E402
 
-pd.options.mode.copy_on_write = True
+from PyQt5.QtCore import QTimer  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from app.gui import InvoiceGeneratorApp  # noqa: E402
+
+
+def report_startup_time():
+    # run with `python -X importtime main.py` to find out which import is responsible for a regression
+    if sys.stderr is not None:
+        print(f"Window shown {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms after start", file=sys.stderr)
 
 
 def main():
@@ -14,10 +23,13 @@ def main():
     window = InvoiceGeneratorApp()
     window.setMinimumWidth(500)
     window.show()
+    QTimer.singleShot(0, report_startup_time)
 
     sys.exit(app.exec())
 
 
 if __name__ == "__main__":
     # TODO: setup CI to package as exe
+    # required for the reader process pool to work in the PyInstaller executable
+    freeze_support()
     main()
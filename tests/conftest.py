@@ -0,0 +1,33 @@
+import shutil
+from datetime import date
+
+import pytest
+
+from create import ScheduleConfig, write_schedules
+
+FROM_DATE = date(2025, 6, 1)
+TO_DATE = date(2025, 6, 30)
+
+
+@pytest.fixture(autouse=True)
+def user_cache(tmp_path, monkeypatch):
+    """ Keeps the caches of the runs in a test out of the user's cache directory """
+    directory = tmp_path / "user-cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(directory))
+    monkeypatch.setenv("LOCALAPPDATA", str(directory))
+    return directory
+
+
+@pytest.fixture(scope="session")
+def generated_schedules(tmp_path_factory):
+    base_path = tmp_path_factory.mktemp("generated")
+    write_schedules(base_path, ScheduleConfig(start=FROM_DATE, days=6, rows_per_sheet=8))
+    return base_path
+
+
+@pytest.fixture
+def schedules(generated_schedules, tmp_path):
+    """ A copy of the generated schedules which a test can change or write its caches into """
+    base_path = tmp_path / "schedules"
+    shutil.copytree(generated_schedules, base_path)
+    return base_path
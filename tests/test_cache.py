@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pandas import Series
+
+from app import cache
+from app.cache import DirectoryIndex, ScheduleCache, cache_directory, load_tour_index, save_tour_index
+from app.core import TourIndex
+from app.pipeline import generate_invoices
+from tests.conftest import FROM_DATE, TO_DATE
+
+
+def run(input_directory, output_directory, **kwargs):
+    summary = generate_invoices(lambda message: None, str(input_directory), FROM_DATE, TO_DATE,
+                                output_directory=str(output_directory), incremental=False, **kwargs)
+    return summary.restaurants
+
+
+def test_cache_is_kept_out_of_the_input_directory(schedules, user_cache, tmp_path):
+    run(schedules, tmp_path / "output")
+    assert not any(name.startswith(".") for name in os.listdir(schedules))
+    assert os.path.commonpath([cache_directory(schedules), user_cache]) == str(user_cache)
+    assert os.listdir(cache_directory(schedules))
+
+
+def test_cached_runs_match_uncached_after_a_rename(schedules, tmp_path):
+    uncached = run(schedules, tmp_path / "uncached", use_cache=False)
+    assert run(schedules, tmp_path / "first", use_cache=True) == uncached
+
+    os.rename(schedules / "June" / "5-June.xlsx", schedules / "June" / "05-June.xlsx")
+    assert run(schedules, tmp_path / "renamed", use_cache=True) == run(schedules, tmp_path / "renamed_uncached",
+                                                                        use_cache=False)
+
+
+def test_tour_index_forgets_renamed_files(tmp_path):
+    kept = tmp_path / "4-June.xlsx"
+    renamed = tmp_path / "5-June.xlsx"
+    kept.touch()
+    renamed.touch()
+    save_tour_index(tmp_path / "cache", TourIndex({str(kept): [1, 2], str(renamed): [3]}))
+
+    renamed.rename(tmp_path / "05-June.xlsx")
+    tours = load_tour_index(tmp_path / "cache")
+    assert tours.files == {str(kept): [1, 2]}
+    assert tours.owners == {1: str(kept), 2: str(kept)}
+
+
+def test_caches_sharing_a_directory_keep_each_others_entries(tmp_path):
+    files = []
+    for day in range(1, 5):
+        files.append(tmp_path / f"{day}-June.xlsx")
+        files[-1].write_bytes(b"schedule %d" % day)
+
+    # like a watcher and a run which loaded the cache before either saved it
+    first, second = ScheduleCache(tmp_path / "cache"), ScheduleCache(tmp_path / "cache")
+    for cache, own_files in [(first, files[:2]), (second, files[2:])]:
+        for file in own_files:
+            assert not cache.fresh(file)
+            cache.put(file, file.name)
+    first.save()
+    second.save()
+
+    cache = ScheduleCache(tmp_path / "cache")
+    assert [cache.get(file) for file in files] == [file.name for file in files]
+
+
+def test_concurrent_saves_do_not_fail(tmp_path):
+    file = tmp_path / "1-June.xlsx"
+    file.write_bytes(b"schedule")
+
+    def put_and_save(n):
+        cache = ScheduleCache(tmp_path / "cache")
+        for _ in range(n):
+            cache.fresh(file)
+            cache.put(file, "result")
+            cache.save()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(put_and_save, 20) for _ in range(4)]:
+            future.result()
+    assert ScheduleCache(tmp_path / "cache").get(file) == "result"
+    # no temporary files are left behind, nor pickles of the versions replaced by another thread
+    assert len(os.listdir(tmp_path / "cache")) == 3
+
+
+def test_tour_indexes_saved_by_two_runs_are_merged(tmp_path):
+    files = [tmp_path / f"{day}-June.xlsx" for day in range(1, 4)]
+    for file in files:
+        file.touch()
+    save_tour_index(tmp_path / "cache", TourIndex({str(files[0]): [1], str(files[1]): [2, 3]}))
+
+    # two runs load the index, one reads the second file again, without tour 3, the other a new file
+    first, second = load_tour_index(tmp_path / "cache"), load_tour_index(tmp_path / "cache")
+    first.release([files[1]])
+    first.claim(np.array([2]), Series([files[1].name]))
+    second.release([files[2]])
+    second.claim(np.array([4]), Series([files[2].name]))
+    save_tour_index(tmp_path / "cache", first)
+    save_tour_index(tmp_path / "cache", second)
+
+    tours = load_tour_index(tmp_path / "cache")
+    assert tours.files == {str(files[0]): [1], str(files[1]): [2], str(files[2]): [4]}
+
+
+def test_directory_index_lists_a_folder_changed_in_the_same_tick_again(tmp_path):
+    folder = tmp_path / "June"
+    folder.mkdir()
+    (folder / "1-June.xlsx").touch()
+    mtime = os.stat(folder).st_mtime_ns
+    index = DirectoryIndex(tmp_path / "cache")
+    assert index.days(folder) == {"1-June.xlsx": 1}
+    index.save()
+
+    # a schedule added without the folder's mtime moving, like within one tick of a coarse clock
+    (folder / "2-June.xlsx").touch()
+    os.utime(folder, ns=(mtime, mtime))
+    assert DirectoryIndex(tmp_path / "cache").days(folder) == {"1-June.xlsx": 1, "2-June.xlsx": 2}
+
+
+def test_directory_index_reuses_folders_changed_long_before_their_scan(tmp_path, monkeypatch):
+    folder = tmp_path / "June"
+    folder.mkdir()
+    (folder / "1-June.xlsx").touch()
+    an_hour_ago = os.stat(folder).st_mtime_ns - 3600 * 10 ** 9
+    os.utime(folder, ns=(an_hour_ago, an_hour_ago))
+    index = DirectoryIndex(tmp_path / "cache")
+    index.days(folder)
+    index.save()
+
+    def scan(dir_path):
+        raise AssertionError(f"{dir_path} listed again")
+
+    monkeypatch.setattr(cache, "scan_schedule_directory", scan)
+    assert DirectoryIndex(tmp_path / "cache").days(folder) == {"1-June.xlsx": 1}
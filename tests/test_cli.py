@@ -0,0 +1,41 @@
+import glob
+import json
+import os
+import shutil
+
+import pandas
+import pytest
+from openpyxl import Workbook
+
+from app.cli import main
+from tests.conftest import FROM_DATE, TO_DATE
+
+
+def test_range_without_schedule_rows(generated_schedules, tmp_path, capsys):
+    input_directory = tmp_path / "schedules"
+    (input_directory / "June").mkdir(parents=True)
+    shutil.copy(generated_schedules / "Rates.xlsx", input_directory)
+    # a schedule with an empty sheet for Dawat, a misnamed one for WaytoIndia and none for the others
+    workbook = Workbook()
+    workbook.active.title = "Dawat"
+    workbook.create_sheet("Waytoindia ")
+    workbook.save(input_directory / "June" / "1-June.xlsx")
+
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(input_directory), "-o", str(tmp_path / "output"), "--from-date", FROM_DATE.isoformat(),
+              "--to-date", TO_DATE.isoformat(), "--workers", "1", "--no-cache", "--quiet"])
+    result = json.loads(capsys.readouterr().out)
+    assert exit_info.value.code == 0
+    assert result["status"] == "ok"
+    assert result["rows"] == 0
+    assert all(counts["serviced"] == 0 for counts in result["restaurants"].values())
+
+    reasons = {}
+    for path in glob.glob(str(tmp_path / "output" / "*" / "*" / "Invalid.xlsx")):
+        restaurant = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        reasons[restaurant] = pandas.read_excel(path)["Reason"].tolist()
+    assert reasons == {
+        "WelcomeIndia": ["Sheet for restaurant not found"],
+        "WaytoIndia": ["Sheetname for restaurant has a typo"],
+        "Tara": ["Sheet for restaurant not found"],
+    }
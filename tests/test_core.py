@@ -0,0 +1,120 @@
+import os
+from datetime import date, datetime, time
+
+from pandas import DataFrame, Series, Timestamp
+
+from app.core import EFFECTIVE_FROM, RatesIndex, TourIndex, compact_schedule, convert_to_date, convert_to_dates, \
+    filter_cancelled_tours, filter_possible_duplicates, process_rates_df
+
+
+def test_filter_cancelled_tours_without_string_values():
+    df = compact_schedule(DataFrame({
+        "Delivery": [time(12, 30), None, None],
+        "Remarks": [1, None, 2],
+    }))
+    serviced_df, cancelled_df = filter_cancelled_tours(df)
+    assert len(serviced_df) == 3
+    assert cancelled_df.empty
+
+
+def test_filter_cancelled_tours_mixed_values():
+    df = compact_schedule(DataFrame({
+        "Delivery": [time(12, 30), "Cancelled by DMC", None, 3],
+        "Remarks": [None, None, " cancel", "CANCELLED"],
+    }))
+    serviced_df, cancelled_df = filter_cancelled_tours(df)
+    assert cancelled_df.index.tolist() == [1, 3]
+    assert serviced_df.index.tolist() == [0, 2]
+
+
+def schedule_rows(file_names, tour_codes):
+    return DataFrame({
+        "File Name": file_names,
+        "Tour Code": tour_codes,
+        "Service Date Cleaned": [date(2025, 6, 1)] * len(file_names),
+        "Dmc To Join": ["thomas cook"] * len(file_names),
+        "Service Type": ["Lunch"] * len(file_names),
+        "Restaurant": ["Dawat"] * len(file_names),
+    })
+
+
+def test_filter_possible_duplicates_across_files(tmp_path):
+    tours = TourIndex()
+    tours.release([tmp_path / "June" / "1-June.xlsx", tmp_path / "June" / "2-June.xlsx"])
+    df = schedule_rows(["1-June.xlsx", "2-June.xlsx", "2-June.xlsx"], ["T1", "T1", "T2"])
+
+    unique_df, duplicates_df = filter_possible_duplicates(df, tours)
+    assert unique_df["Tour Code"].tolist() == ["T1", "T2"]
+    assert duplicates_df["File Name"].tolist() == ["2-June.xlsx"]
+    assert duplicates_df["Duplicate Of"].tolist() == [os.path.join("June", "1-June.xlsx")]
+
+
+def test_filter_possible_duplicates_ignores_missing_tour_codes():
+    df = schedule_rows(["1-June.xlsx", "2-June.xlsx", "2-June.xlsx"], ["None", "None", "nan"])
+    unique_df, duplicates_df = filter_possible_duplicates(df)
+    assert len(unique_df) == 3
+    assert duplicates_df.empty
+
+
+def test_released_file_gives_up_its_tours(tmp_path):
+    tours = TourIndex()
+    tours.release([tmp_path / "1-June.xlsx"])
+    filter_possible_duplicates(schedule_rows(["1-June.xlsx"], ["T1"]), tours)
+
+    # the tour was removed from 1-June.xlsx, it is billed from 2-June.xlsx on the next run
+    tours.release([tmp_path / "1-June.xlsx", tmp_path / "2-June.xlsx"])
+    unique_df, duplicates_df = filter_possible_duplicates(schedule_rows(["2-June.xlsx"], ["T1"]), tours)
+    assert len(unique_df) == 1
+    assert duplicates_df.empty
+    assert list(tours.files) == [str(tmp_path / "2-June.xlsx")]
+
+
+def test_convert_to_dates_matches_convert_to_date():
+    values = Series([
+        "2025-06-01", " 2025-06-01 ", "2025_06_02", "2025-06-03 00:00:00", "06-04-2025", "06/05/2025",
+        "June 6, 2025", "7 June 2025", "not a date", "", None, float("nan"),
+        Timestamp(2025, 6, 8), datetime(2025, 6, 9, 12, 30), date(2025, 6, 10), 3,
+    ], index=range(10, 26), dtype=object)
+    dates = convert_to_dates(values)
+    assert dates.index.equals(values.index)
+    # the vectorized parsing gives the same dates as parsing every value on its own
+    assert dates.tolist() == [convert_to_date(value) for value in values]
+    assert dates.tolist()[:8] == [date(2025, 6, day) for day in [1, 1, 2, 3, 4, 5, 6, 7]]
+
+
+def test_rates_index_picks_the_table_in_effect():
+    rates_df = process_rates_df(lambda x: None, DataFrame({
+        "DMC": ["Default", "Acme", "Default", "Acme"],
+        "Lunch": [20, None, 25, 30],
+        "Child": [10, 12, 11, None],
+        EFFECTIVE_FROM: [Timestamp(2025, 6, 10)] * 2 + [Timestamp(2025, 6, 20)] * 2,
+    }))
+    rates = RatesIndex(rates_df)
+
+    dates = Series([date(2025, 6, 9), date(2025, 6, 10), date(2025, 6, 19), date(2025, 6, 20), date(2025, 7, 1)])
+    found = rates.lookup(Series(["acme"] * 5), Series(["Lunch"] * 5), dates)
+    # before the first table there is no rate, the Default fills the gaps of its own table only
+    assert found["Rate"].isna().tolist() == [True, False, False, False, False]
+    assert found["Rate"].tolist()[1:] == [20, 20, 30, 30]
+    assert found["Rate Child"].tolist()[1:] == [12, 12, 11, 11]
+
+    # without service dates the latest table applies
+    assert rates.lookup(Series(["acme"]), Series(["Lunch"]))["Rate"].tolist() == [30]
+
+
+def test_rates_sheet_without_default_is_not_used():
+    messages = []
+    rates_df = process_rates_df(messages.append, DataFrame({
+        "DMC": ["Default", "Acme", "Acme"],
+        "Lunch": [20, 22, 30],
+        "Child": [10, 12, 15],
+        EFFECTIVE_FROM: [Timestamp(2025, 6, 10)] * 2 + [Timestamp(2025, 6, 20)],
+    }))
+    assert messages == ["Default rates not found in sheet 2025-06-20 of the rates file, its rates are not used"]
+    assert "Lunch" not in rates_df.columns
+
+    # the rates of the sheet before it still apply
+    found = RatesIndex(rates_df).lookup(Series(["acme"] * 2), Series(["Lunch"] * 2),
+                                        Series([date(2025, 6, 10), date(2025, 6, 25)]))
+    assert found.columns.tolist() == ["Dmc Canonical", "Rate", "Rate Child"]
+    assert found["Rate"].tolist() == [22, 22]
@@ -0,0 +1,134 @@
+import glob
+import os
+from contextlib import closing
+from datetime import date
+
+import pandas
+import pytest
+from pandas import DataFrame
+from openpyxl.reader.excel import load_workbook
+
+from app import io
+from app.core import RESTAURANTS, process_all
+from app.cache import DirectoryIndex
+from app.io import INVOICE_MANIFEST, list_files, read_all_files, read_workbook, write_all_invoices
+from app.pipeline import RunSummary, load_rates, write_results
+from app.xlsx import FastWorkbook
+from tests.conftest import FROM_DATE, TO_DATE
+
+ADDRESS = RESTAURANTS[0].address
+
+
+def updater(message):
+    pass
+
+
+@pytest.fixture(scope="module")
+def serviced_df(generated_schedules):
+    base_dir = str(generated_schedules)
+    results = process_all(RESTAURANTS, FROM_DATE, TO_DATE, load_rates(updater, base_dir),
+                          *read_all_files(updater, FROM_DATE, TO_DATE, base_dir))
+    return results[RESTAURANTS[0].name][0]
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """ The names of the invoices generated instead of copied from the previous run """
+    names = []
+    write_invoice_file = io.write_invoice_file
+
+    def recording(save_path, *args):
+        names.append(os.path.basename(save_path))
+        return write_invoice_file(save_path, *args)
+
+    monkeypatch.setattr(io, "write_invoice_file", recording)
+    return names
+
+
+def test_fast_reader_matches_openpyxl(generated_schedules):
+    files = sorted(glob.glob(os.path.join(generated_schedules, "*", "*.xlsx")))
+    assert files
+    for file in files:
+        filename = os.path.basename(file)
+        # read_file falls back to openpyxl silently, the fast reader has to read these on its own
+        with closing(FastWorkbook(file)) as workbook:
+            fast_df, fast_not_found, fast_typos = read_workbook(filename, workbook)
+        df, not_found, typos = read_workbook(filename, load_workbook(file, read_only=True))
+
+        pandas.testing.assert_frame_equal(fast_df, df)
+        assert fast_not_found == not_found
+        assert fast_typos == typos
+
+
+def write_run(run_dir, df, previous_dir=None):
+    os.makedirs(run_dir)
+    write_all_invoices(updater, str(run_dir), ADDRESS, df, previous_dir and str(previous_dir))
+    return sorted(name for name in os.listdir(run_dir) if name != INVOICE_MANIFEST)
+
+
+def test_unchanged_invoices_are_copied(serviced_df, written, tmp_path):
+    invoices = write_run(tmp_path / "first", serviced_df)
+    assert len(invoices) > 1 and sorted(written) == invoices
+
+    written.clear()
+    assert write_run(tmp_path / "second", serviced_df, tmp_path / "first") == invoices
+    assert written == []
+    for invoice in invoices:
+        assert (tmp_path / "second" / invoice).read_bytes() == (tmp_path / "first" / invoice).read_bytes()
+
+
+def test_changed_invoices_are_regenerated(serviced_df, written, tmp_path):
+    invoices = write_run(tmp_path / "first", serviced_df)
+
+    changed_df = serviced_df.copy()
+    dmc = changed_df["Dmc Canonical"].iloc[0]
+    changed_df.loc[changed_df.index[0], "Adult"] = 99
+    written.clear()
+    assert write_run(tmp_path / "second", changed_df, tmp_path / "first") == invoices
+    assert written == [f"{dmc}.xlsx"]
+
+
+def test_invoices_edited_by_hand_are_regenerated(serviced_df, written, tmp_path):
+    invoices = write_run(tmp_path / "first", serviced_df)
+    edited = tmp_path / "first" / invoices[0]
+    workbook = load_workbook(edited)
+    workbook.active["A5"] = "Invoice No. 42"
+    workbook.save(edited)
+
+    written.clear()
+    assert write_run(tmp_path / "second", serviced_df, tmp_path / "first") == invoices
+    assert written == [invoices[0]]
+    assert load_workbook(tmp_path / "second" / invoices[0]).active["A5"].value == "Invoice No."
+
+
+def test_list_files_skips_schedules_out_of_range(tmp_path):
+    for name in ["May/31-May.xlsx", "June/9-June.xlsx", "June/10-June.xlsx", "June/30 June.xlsx", "June/notes.txt",
+                 "June/Rates June.xlsx", "Jul/5-July.xlsx", "Jul/6-July.xlsx", "August/1-August.xlsx"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+
+    expected = sorted(f"{tmp_path}/{name}" for name in ["June/10-June.xlsx", "June/30 June.xlsx", "Jul/5-July.xlsx"])
+    assert sorted(list_files(updater, date(2025, 6, 10), date(2025, 7, 5), str(tmp_path))) == expected
+    index = DirectoryIndex(tmp_path / "cache")
+    assert sorted(list_files(updater, date(2025, 6, 10), date(2025, 7, 5), str(tmp_path), index)) == expected
+    # the index lists the folders, not the range, another range of the same folders is filtered anew
+    assert list_files(updater, date(2025, 6, 1), date(2025, 6, 9), str(tmp_path), index) == [
+        f"{tmp_path}/June/9-June.xlsx"]
+
+
+def test_failing_invoice_in_the_pool_leaves_the_others_written(serviced_df, tmp_path):
+    df = serviced_df.copy()
+    df["Dmc Canonical"] = df["Dmc Canonical"].astype(object)
+    dmcs = sorted(df["Dmc Canonical"].unique())
+    # the slash makes the path of the invoice point into a folder that does not exist
+    df.loc[df["Dmc Canonical"] == dmcs[0], "Dmc Canonical"] = "Thomas/Cook"
+    restaurants = RESTAURANTS[:2]
+    results = {restaurant.name: (df, DataFrame(), DataFrame()) for restaurant in restaurants}
+    messages = []
+
+    write_results(messages.append, RunSummary(), restaurants, results, str(tmp_path), incremental=False, workers=2)
+    assert sum(message.startswith("Unable to write invoice for Thomas/Cook") for message in messages) == 2
+    for restaurant in restaurants:
+        [run_dir] = (tmp_path / restaurant.name).iterdir()
+        assert sorted(os.listdir(run_dir)) == sorted([INVOICE_MANIFEST, "Summary.xlsx",
+                                                      *(f"{dmc}.xlsx" for dmc in dmcs[1:])])
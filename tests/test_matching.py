@@ -0,0 +1,62 @@
+import json
+
+from pandas import DataFrame
+
+from app.core import ALIAS, SUGGESTION, RatesIndex, compact_schedule, filter_unknown_dmcs, process_rates_df
+from app.matching import ALIAS_VERSION, AliasTable, NameResolver, TrigramIndex
+
+
+def updater(message):
+    pass
+
+
+def rates():
+    return RatesIndex(process_rates_df(updater, DataFrame({
+        "DMC": ["Default", "Thomas Cook", "SOTC"], "Lunch": [20, 25, None], "Child": [10, None, None],
+    })))
+
+
+def schedule():
+    return compact_schedule(DataFrame({"Dmc": ["Thomas Cok", "Thomas Cook", "Nobody"], "Service Type": ["Lunch"] * 3}))
+
+
+def test_trigram_index_matches_typos_only():
+    index = TrigramIndex(["thomas cook", "sotc", "kesari"])
+    assert index.match("thomas cok") == "thomas cook"
+    assert index.match("cox & kings") is None
+
+
+def test_matches_are_only_suggested(tmp_path):
+    aliases = AliasTable(str(tmp_path / "Aliases.json"))
+    known_df, unknown_df = filter_unknown_dmcs(schedule(), rates(), NameResolver(updater, aliases))
+
+    assert known_df["Dmc"].tolist() == ["Thomas Cook"]
+    assert unknown_df["Dmc To Join"].tolist() == ["thomas cok", "nobody"]
+    assert unknown_df[SUGGESTION].tolist()[0] == 'DMC "thomas cok" may be "thomas cook"'
+    assert aliases.suggestions == {"DMC": {"thomas cok": "thomas cook"}}
+    assert aliases.aliases == {}
+
+
+def test_accepted_aliases_are_applied_and_noted(tmp_path):
+    aliases = AliasTable(str(tmp_path / "Aliases.json"))
+    aliases.aliases = {"DMC": {"thomas cok": "thomas cook", "nobody": None}}
+    known_df, unknown_df = filter_unknown_dmcs(schedule(), rates(), NameResolver(updater, aliases))
+
+    assert known_df["Dmc"].tolist() == ["Thomas Cok", "Thomas Cook"]
+    assert known_df["Dmc To Join"].tolist() == ["thomas cook", "thomas cook"]
+    assert known_df[ALIAS].tolist()[0] == 'DMC "thomas cok" as "thomas cook"'
+    # a name aliased to null stays unknown without a suggestion
+    assert unknown_df["Dmc"].tolist() == ["Nobody"]
+    assert SUGGESTION not in unknown_df.columns
+
+
+def test_first_version_matches_become_suggestions(tmp_path):
+    path = tmp_path / "Aliases.json"
+    path.write_text(json.dumps({"version": 1, "aliases": {"DMC": {"thomas cok": "thomas cook", "nobody": None}}}))
+    aliases = AliasTable(str(path))
+    aliases.save()
+
+    table = json.loads(path.read_text())
+    assert table["version"] == ALIAS_VERSION
+    assert table["aliases"] == {"DMC": {"nobody": None}}
+    assert table["suggestions"] == {"DMC": {"thomas cok": "thomas cook"}}
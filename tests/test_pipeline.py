@@ -0,0 +1,103 @@
+import os
+from datetime import timedelta
+
+import pandas
+import pyarrow.dataset as ds
+from pandas import concat
+
+from app.core import RESTAURANTS, process_all, process_chunks
+from app.io import iter_schedule_chunks, read_all_files
+from app.pipeline import generate_invoices, load_rates
+from create import ScheduleConfig, write_schedules
+from tests.conftest import FROM_DATE, TO_DATE
+
+
+def updater(message):
+    pass
+
+
+def comparable(df):
+    return df.astype(object).reset_index(drop=True).sort_index(axis=1)
+
+
+def test_chunked_results_match_unchunked(generated_schedules):
+    base_dir = str(generated_schedules)
+    rates = load_rates(updater, base_dir)
+    expected = process_all(RESTAURANTS, FROM_DATE, TO_DATE, rates,
+                           *read_all_files(updater, FROM_DATE, TO_DATE, base_dir))
+    chunks = iter_schedule_chunks(updater, FROM_DATE, TO_DATE, base_dir, chunk_files=2)
+    actual = process_chunks(RESTAURANTS, FROM_DATE, TO_DATE, rates, chunks)
+
+    for restaurant in RESTAURANTS:
+        for expected_df, actual_df in zip(expected[restaurant.name], actual[restaurant.name]):
+            pandas.testing.assert_frame_equal(comparable(actual_df), comparable(expected_df))
+
+
+def test_schedules_without_prices_are_billed_at_the_rates(tmp_path):
+    write_schedules(tmp_path, ScheduleConfig(start=FROM_DATE, days=2, rows_per_sheet=8, price_rate=0))
+    results = process_all(RESTAURANTS, FROM_DATE, TO_DATE, load_rates(updater, str(tmp_path)),
+                          *read_all_files(updater, FROM_DATE, TO_DATE, str(tmp_path)))
+    serviced_df = results["Dawat"][0]
+    assert not serviced_df.empty
+    assert (serviced_df["Price Adult"] == serviced_df["Rate"]).all()
+
+
+def test_typed_prices_are_billed_instead_of_the_rates(generated_schedules):
+    base_dir = str(generated_schedules)
+    df, not_found_df, typos_df = read_all_files(updater, FROM_DATE, TO_DATE, base_dir)
+    priced = set(df.loc[df["Price Adult"].notna(), "Tour Code"].astype(str))
+    results = process_all(RESTAURANTS, FROM_DATE, TO_DATE, load_rates(updater, base_dir), df, not_found_df, typos_df)
+
+    serviced_df = concat([results[restaurant.name][0] for restaurant in RESTAURANTS])
+    priced_mask = serviced_df["Tour Code"].isin(priced).to_numpy()
+    assert priced_mask.any()
+    assert (serviced_df["Price Adult"] == serviced_df["Rate"])[~priced_mask].all()
+
+
+def run(input_directory, output_directory, **kwargs):
+    return generate_invoices(updater, str(input_directory), FROM_DATE, TO_DATE,
+                             output_directory=str(output_directory), incremental=False, **kwargs)
+
+
+def partitions(directory):
+    return sorted(os.path.relpath(root, directory) for root, _, files in os.walk(directory) if files)
+
+
+def test_chunked_parquet_export_matches_unchunked(generated_schedules, tmp_path):
+    run(generated_schedules, tmp_path / "all", parquet=True, use_cache=False)
+    run(generated_schedules, tmp_path / "chunked", parquet=True, use_cache=False, chunk_files=2)
+
+    for kind in ("serviced", "cancelled", "invalid"):
+        all_dir = tmp_path / "all" / "Parquet" / kind
+        chunked_dir = tmp_path / "chunked" / "Parquet" / kind
+        assert partitions(chunked_dir) == partitions(all_dir)
+        assert all(partition.startswith("Restaurant=") for partition in partitions(all_dir))
+
+        all_table = ds.dataset(all_dir, partitioning="hive").to_table()
+        chunked_table = ds.dataset(chunked_dir, partitioning="hive").to_table()
+        assert sorted(chunked_table.schema.names) == sorted(all_table.schema.names)
+        assert chunked_table.num_rows == all_table.num_rows
+
+
+def parquet_rows(directory, kind):
+    df = ds.dataset(directory / "Parquet" / kind, partitioning="hive").to_table().to_pandas()
+    df = df.astype(str).sort_index(axis=1)
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+def test_runs_over_part_of_a_month_keep_the_rest_of_the_parquet_dataset(generated_schedules, tmp_path):
+    run(generated_schedules, tmp_path / "expected", parquet=True, use_cache=False)
+
+    run(generated_schedules, tmp_path / "season", parquet=True, use_cache=False)
+    generate_invoices(updater, str(generated_schedules), FROM_DATE, FROM_DATE + timedelta(days=2),
+                      output_directory=str(tmp_path / "season"), incremental=False, parquet=True, use_cache=False)
+    for kind in ("serviced", "cancelled", "invalid"):
+        expected_df = parquet_rows(tmp_path / "expected", kind)
+        assert not expected_df.empty
+        pandas.testing.assert_frame_equal(parquet_rows(tmp_path / "season", kind), expected_df)
+
+    # running the whole range again replaces every row instead of adding them twice
+    run(generated_schedules, tmp_path / "season", parquet=True, use_cache=False)
+    for kind in ("serviced", "cancelled", "invalid"):
+        pandas.testing.assert_frame_equal(parquet_rows(tmp_path / "season", kind),
+                                          parquet_rows(tmp_path / "expected", kind))
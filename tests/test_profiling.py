@@ -0,0 +1,18 @@
+from app.profiling import SUMMARY_COLUMNS, Profiler, span
+
+
+def test_peak_rss_is_reported_once_per_run():
+    profiler = Profiler()
+    with profiler.activate():
+        with span("read_file", "1-June.xlsx", rows=3):
+            pass
+        with span("read_file", "2-June.xlsx", rows=4):
+            pass
+        assert profiler.peak_rss is None
+
+    assert [measured.rows for measured in profiler.spans] == [3, 4]
+    assert all(len(row) == len(SUMMARY_COLUMNS) for row in profiler.summary_rows())
+    assert profiler.summary()[0]["rows"] == 7
+    assert "peak_rss" not in profiler.summary()[0]
+    assert profiler.peak_rss > 0
+    assert profiler.format_summary().endswith(profiler.format_peak_rss())